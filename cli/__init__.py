@@ -0,0 +1,24 @@
+# The Python API is imported on first use, as it pulls in pandas, numpy and
+# docker, which would slow down every dk command including shell completion
+__all__ = [
+    "Datakit",
+    "Run",
+    "DatakitError",
+    "NoActiveRunError",
+    "RunNameError",
+    "RunExistsError",
+    "RunNotFoundError",
+    "VariableError",
+    "ViewError",
+    "PipelineError",
+    "RunExecutionError",
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        from cli import api
+
+        return getattr(api, name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
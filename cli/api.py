@@ -0,0 +1,1568 @@
+import io
+import os
+import errno
+import stat
+import time
+import shutil
+import re
+import pickle
+import hashlib
+import fcntl
+import threading
+import docker
+import zstandard
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager, ExitStack
+from functools import cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Any, Callable, Dict, List, Union
+from datakitpy.datakit import (
+    ExecutionError,
+    ResourceError,
+    execute_datakit,
+    execute_view,
+    init_resource,
+    load_resource_by_variable,
+    write_resource,
+    update_resource,
+    load_run_configuration,
+    write_run_configuration,
+    load_variable,
+    load_datakit_configuration,
+    load_algorithm,
+    get_algorithm_name,
+    RUN_DIR,
+    VIEW_ARTEFACTS_DIR,
+)
+from datakitpy.helpers import find_by_name
+from cli.index import (
+    CONFIG_FILE,
+    DATAKIT_FILE,
+    INDEX_FILE,
+    RUN_EXTENSION,
+    DEFAULT_COMPRESSION,
+    write_json,
+    get_run_names,
+    get_active_run_name,
+    load_index,
+)
+
+DATAKIT_LOCK_FILE = "{base_path}/.datakit.lock"
+STORE_DIR = "{base_path}/.store"  # Content-addressed file store
+RUN_LOCK_FILE = "{run_dir}/.lock"
+STORED_RUN_DIRS = ["resources", "views"]  # Subdirectories with stored files
+COMPRESSED_EXTENSION = ".zst"
+
+
+# Locks held by the current thread, so locks can be re-entered
+_held_locks = threading.local()
+
+
+# Exceptions
+
+
+class DatakitError(Exception):
+    """Base class for errors raised when operating on a datakit"""
+
+
+class NoActiveRunError(DatakitError):
+    """Raised when no run is specified and no active run is set"""
+
+
+class RunNameError(DatakitError):
+    """Raised when a run name is invalid"""
+
+
+class RunExistsError(DatakitError):
+    """Raised when initialising a run that already exists"""
+
+
+class RunNotFoundError(DatakitError):
+    """Raised when a run does not exist"""
+
+
+class VariableError(DatakitError):
+    """Raised when a variable or variable value is invalid"""
+
+
+class ViewError(DatakitError):
+    """Raised when a view can't be generated from the run resources"""
+
+
+class PipelineError(DatakitError):
+    """Raised when a pipeline definition is invalid"""
+
+
+class RunExecutionError(DatakitError):
+    """Raised when an algorithm or view container fails
+
+    The container logs are available as the logs attribute.
+    """
+
+    def __init__(self, message: str, logs: str):
+        super().__init__(message)
+        self.logs = logs
+
+
+# Helpers
+
+
+@cache
+def get_docker_client() -> docker.DockerClient:
+    """Return a Docker client, connecting to the daemon on first use"""
+    return docker.from_env()
+
+
+def open_lock_file(lock_path: str, shared: bool):
+    """Open a lock file, creating it if needed
+
+    Readers without write access open an existing lock file read-only, and
+    None is returned if it doesn't exist, as no writer has ever taken it.
+    """
+    try:
+        return open(lock_path, "a")
+    except OSError as e:
+        if not shared or e.errno not in (
+            errno.EACCES,
+            errno.EPERM,
+            errno.EROFS,
+        ):
+            raise
+
+    try:
+        return open(lock_path, "r")
+    except FileNotFoundError:
+        if not os.path.isdir(os.path.dirname(lock_path) or "."):
+            raise
+        return None
+
+
+@contextmanager
+def lock(lock_path: str, blocking: bool = True, shared: bool = False):
+    """Hold an advisory lock on lock_path
+
+    Locks are exclusive, or shared between readers if shared is True. Locks
+    are re-entrant within a thread, but an exclusive lock can't be taken
+    while the thread holds a shared one, as upgrading would deadlock with
+    other readers. If blocking is False and the lock is held elsewhere,
+    BlockingIOError is raised. FileNotFoundError is raised if the lock file
+    is removed (e.g. its directory is deleted) while waiting for the lock.
+    """
+    held = _held_locks.__dict__.setdefault("counts", {})
+    modes = _held_locks.__dict__.setdefault("shared", {})
+
+    if held.get(lock_path):
+        if modes[lock_path] and not shared:
+            raise RuntimeError(
+                f"Can't take an exclusive lock on {lock_path} while holding "
+                "a shared one"
+            )
+
+        held[lock_path] += 1
+        try:
+            yield
+        finally:
+            held[lock_path] -= 1
+        return
+
+    with ExitStack() as stack:
+        f = open_lock_file(lock_path, shared)
+
+        if f is not None:
+            stack.enter_context(f)
+            fcntl.flock(
+                f,
+                (fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                | (0 if blocking else fcntl.LOCK_NB),
+            )
+
+            try:
+                stale = not os.path.samestat(
+                    os.fstat(f.fileno()), os.stat(lock_path)
+                )
+            except FileNotFoundError:
+                stale = True
+
+            if stale:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                raise FileNotFoundError(f"{lock_path} was removed")
+
+            stack.callback(fcntl.flock, f, fcntl.LOCK_UN)
+
+        held[lock_path] = 1
+        modes[lock_path] = shared
+        try:
+            yield
+        finally:
+            held[lock_path] = 0
+
+
+def detach_file(path: str) -> None:
+    """Replace a hard linked file with a private, writable copy"""
+    shutil.copyfile(path, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def format_size(num_bytes: int) -> str:
+    """Format a size in bytes as a human readable string"""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
+def compress_file(path: str, level: int) -> str:
+    """Compress a file with zstd, replacing it with path + ".zst"
+
+    Data is streamed, so the file is never held in memory. Returns the path
+    of the compressed file.
+    """
+    compressed_path = path + COMPRESSED_EXTENSION
+    compressor = zstandard.ZstdCompressor(level=level, threads=-1)
+
+    with open(path, "rb") as src, open(compressed_path + ".tmp", "wb") as dst:
+        compressor.copy_stream(src, dst)
+
+    os.replace(compressed_path + ".tmp", compressed_path)
+    os.remove(path)
+
+    return compressed_path
+
+
+def open_compressed(path: str) -> io.BufferedReader:
+    """Open a zstd compressed file for streaming reads of its contents"""
+    return io.BufferedReader(
+        zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+    )
+
+
+def get_run_info(run_dir: str) -> dict:
+    """Return the last modified time and reclaimable size of a run directory
+
+    Files shared with other runs through the store don't count towards the
+    reclaimable size, as deleting the run won't free them.
+    """
+    modified, size = os.stat(run_dir).st_mtime, 0
+
+    for root, _, files in os.walk(run_dir):
+        for name in files:
+            info = os.stat(f"{root}/{name}")
+            modified = max(modified, info.st_mtime)
+
+            # Either a private file, or stored and referenced only by us
+            if info.st_nlink == 1 or (
+                info.st_nlink == 2 and not info.st_mode & stat.S_IWUSR
+            ):
+                size += info.st_size
+
+    return {"modified": modified, "size": size}
+
+
+def diff_frames(
+    a: pd.DataFrame, b: pd.DataFrame, rtol: float, atol: float
+) -> pd.DataFrame:
+    """Return the cells that differ between two DataFrames
+
+    Frames are aligned on their index and columns first, so missing rows and
+    columns count as differences. Numeric columns are compared with
+    numpy.isclose using the given tolerances.
+    """
+    a, b = a.align(b)
+    differs = np.zeros(a.shape, dtype=bool)
+
+    for i, column in enumerate(a.columns):
+        x, y = a[column], b[column]
+
+        if pd.api.types.is_numeric_dtype(x) and pd.api.types.is_numeric_dtype(
+            y
+        ):
+            differs[:, i] = ~np.isclose(
+                x.to_numpy(dtype=float, na_value=np.nan),
+                y.to_numpy(dtype=float, na_value=np.nan),
+                rtol=rtol,
+                atol=atol,
+                equal_nan=True,
+            )
+        else:
+            differs[:, i] = ~((x == y) | (x.isna() & y.isna())).to_numpy()
+
+    rows, columns = np.nonzero(differs)
+
+    return pd.DataFrame(
+        {
+            "row": a.index[rows],
+            "column": a.columns[columns],
+            "a": a.to_numpy()[rows, columns],
+            "b": b.to_numpy()[rows, columns],
+        }
+    )
+
+
+# API
+
+
+class Datakit:
+    """A datakit on disk
+
+    Progress messages (in rich markup) are passed to echo if provided.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        echo: Optional[Callable[[Any], None]] = None,
+    ):
+        self.path = os.path.abspath(path or os.getcwd())
+        self.echo = echo or (lambda message: None)
+
+        self.config_file = CONFIG_FILE.format(base_path=self.path)
+        self.datakit_file = DATAKIT_FILE.format(base_path=self.path)
+        self.lock_file = DATAKIT_LOCK_FILE.format(base_path=self.path)
+        self.index_file = INDEX_FILE.format(base_path=self.path)
+        self.store_dir = STORE_DIR.format(base_path=self.path)
+
+        self._index = None
+
+    def __repr__(self) -> str:
+        return f"Datakit({self.path!r})"
+
+    @contextmanager
+    def edit_configuration(self):
+        """Load datakit.json for modification, writing it back on exit
+
+        datakit.json is locked for the duration, so concurrent modifications
+        from other dk processes aren't lost.
+        """
+        with lock(self.lock_file):
+            datakit = load_datakit_configuration(base_path=self.path)
+            yield datakit
+            write_json(self.datakit_file, datakit)
+
+    # Metadata index
+
+    def load_index(self) -> dict:
+        """Load the datakit metadata index, rebuilding it if it is stale"""
+        self._index = load_index(self.path, self._index)
+        return self._index
+
+    @property
+    def compression_level(self) -> Optional[int]:
+        """zstd level to compress view artefacts with, or None if disabled
+
+        Set per datakit with "compression": {"level": 3} in datakit.json, or
+        "compression": false to disable compression.
+        """
+        compression = self.load_index().get("compression", DEFAULT_COMPRESSION)
+        return compression["level"] if compression else None
+
+    @property
+    def algorithms(self) -> List[str]:
+        """Names of the datakit algorithms"""
+        return list(self.load_index()["algorithms"])
+
+    def get_variable_signature(
+        self, run_name: str, variable_name: str
+    ) -> dict:
+        """Return the algorithm signature of a variable in the given run"""
+        signature = self.load_index()["algorithms"][
+            get_algorithm_name(run_name)
+        ]["signature"]
+        variable = find_by_name(
+            signature["inputs"] + signature["outputs"], variable_name
+        )
+
+        if variable is None:
+            raise VariableError(
+                f'"{variable_name}" is not a variable of '
+                f"{get_algorithm_name(run_name)}"
+            )
+
+        return variable
+
+    # Runs
+
+    def get_full_run_name(self, run_name: Optional[str] = None) -> str:
+        """Validate and return full run name
+
+        If run_name is None, the default run of the first algorithm is
+        returned.
+        """
+        if run_name is None:
+            return self.algorithms[0] + RUN_EXTENSION
+
+        # Check the run_name matches the pattern [algorithm].[name] or
+        # [algorithm]
+        pattern = re.compile(r"^([a-zA-Z0-9_]+)\.([a-zA-Z0-9_]+)$")
+
+        datakit_algorithms = self.algorithms
+
+        if not pattern.match(run_name) and run_name not in datakit_algorithms:
+            raise RunNameError(
+                f'"{run_name}" is not a valid run name\n'
+                "Run names must match the format: [algorithm].[name]\n"
+                "Did you forget to add your algorithm to datakit.json?"
+            )
+
+        algorithm_name = get_algorithm_name(run_name)
+
+        if algorithm_name not in datakit_algorithms:
+            raise RunNameError(
+                f'"{algorithm_name}" is not a valid datakit algorithm\n'
+                f"Available datakit algorithms: {datakit_algorithms}"
+            )
+
+        return run_name + RUN_EXTENSION
+
+    def run_exists(self, run_name: str) -> bool:
+        """Check if specified run exists"""
+        run_dir = RUN_DIR.format(base_path=self.path, run_name=run_name)
+        return os.path.exists(run_dir) and os.path.isdir(run_dir)
+
+    @property
+    def runs(self) -> List["Run"]:
+        """All runs in the datakit"""
+        return [Run(self, run_name) for run_name in get_run_names(self.path)]
+
+    @property
+    def active_run(self) -> Optional["Run"]:
+        """The active run, or None if no run is active"""
+        run_name = get_active_run_name(self.path)
+        return Run(self, run_name) if run_name else None
+
+    def set_active_run(self, run_name: Optional[str] = None) -> "Run":
+        """Set the active run, defaulting to the default run"""
+        run_name = self.get_full_run_name(run_name)
+
+        if not self.run_exists(run_name):
+            raise RunNotFoundError(f"{run_name} does not exist")
+
+        write_json(self.config_file, {"run": run_name})
+
+        return Run(self, run_name)
+
+    def get_run(self, run_name: Optional[str] = None) -> "Run":
+        """Return the specified run, or the active run
+
+        Run names are in the format [algorithm].[run name]
+        """
+        if run_name is None:
+            run = self.active_run
+            if run is None:
+                raise NoActiveRunError(
+                    'No active run is set. Have you run "dk init"?'
+                )
+            return run
+
+        run_name = self.get_full_run_name(run_name)
+
+        if not self.run_exists(run_name):
+            raise RunNotFoundError(f"{run_name} does not exist")
+
+        return Run(self, run_name)
+
+    def init(
+        self, run_name: Optional[str] = None, activate: bool = True
+    ) -> "Run":
+        """Initialise a run with the default run configuration
+
+        Run names are in the format [algorithm].[run name], defaulting to
+        the default run of the first algorithm. If activate is True, the new
+        run becomes the active run.
+        """
+        run = self.init_runs({run_name: {}})[0]
+
+        if activate:
+            write_json(self.config_file, {"run": run.name})
+
+        return run
+
+    def init_runs(
+        self,
+        runs: Dict[Optional[str], Dict[str, Any]],
+        max_workers: Optional[int] = None,
+    ) -> List["Run"]:
+        """Initialise many runs, each with its own input values
+
+        runs maps run names in the format [algorithm].[run name] to input
+        variable values, which are set as with Run.set() or, for resource
+        variables, loaded as with Run.load(). Resources of all runs are
+        initialised concurrently, and datakit.json is updated once. If any
+        run fails to initialise, every run created is removed again, so the
+        same runs can be initialised once the problem is fixed.
+        """
+        run_names = [self.get_full_run_name(run_name) for run_name in runs]
+
+        # Check directories don't already exist before creating any
+        for run_name in run_names:
+            if self.run_exists(run_name) or run_names.count(run_name) > 1:
+                raise RunExistsError(f"{run_name} already exists")
+
+        algorithms = {}
+        resources = []  # (run name, resource name)
+        created = []  # Runs whose directories we've created
+
+        def init(resource: tuple) -> None:
+            run_name, resource_name = resource
+
+            init_resource(
+                run_name=run_name,
+                resource_name=resource_name,
+                base_path=self.path,
+            )
+
+            self.echo(
+                "[bold]=>[/bold] Generated input resource: " f"{resource_name}"
+            )
+
+        def set_inputs(run: Run, inputs: Dict[str, Any]) -> None:
+            for variable_name, value in inputs.items():
+                if run.get_signature(variable_name)["type"] == "resource":
+                    if not isinstance(value, (str, pd.DataFrame)):
+                        # Inline table data
+                        value = pd.DataFrame(value)
+                    run.load(variable_name, value)
+                else:
+                    run.set(variable_name, value)
+
+            # Share identical resources with other runs
+            run.store()
+
+        try:
+            for run_name in run_names:
+                algorithm_name = get_algorithm_name(run_name)
+
+                if algorithm_name not in algorithms:
+                    algorithms[algorithm_name] = load_algorithm(
+                        algorithm_name, base_path=self.path
+                    )
+
+                try:
+                    os.mkdir(
+                        RUN_DIR.format(base_path=self.path, run_name=run_name)
+                    )
+                except FileExistsError:
+                    # Created by another dk process since we checked
+                    raise RunExistsError(f"{run_name} already exists")
+
+                created.append(run_name)
+
+                resources += [
+                    (run_name, resource_name)
+                    for resource_name in self._create_run(
+                        run_name, algorithms[algorithm_name]
+                    )
+                ]
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(init, resources))
+                list(
+                    executor.map(
+                        set_inputs,
+                        [Run(self, run_name) for run_name in run_names],
+                        runs.values(),
+                    )
+                )
+
+            with self.edit_configuration() as datakit:
+                datakit["runs"] += run_names
+        except BaseException:
+            # Roll back on any failure, including KeyboardInterrupt
+            for run_name in created:
+                self.echo(f"[bold]=>[/bold] Removing [bold]{run_name}[/bold]")
+                shutil.rmtree(
+                    RUN_DIR.format(base_path=self.path, run_name=run_name),
+                    ignore_errors=True,
+                )
+            raise
+
+        return [Run(self, run_name) for run_name in run_names]
+
+    def _create_run(self, run_name: str, algorithm: dict) -> List[str]:
+        """Populate a new run directory with a default run configuration
+
+        Returns the names of the resources to initialise
+        """
+        # Create run subdirectories
+        run_dir = RUN_DIR.format(base_path=self.path, run_name=run_name)
+        os.makedirs(f"{run_dir}/resources")
+        os.makedirs(f"{run_dir}/views")
+        self.echo(f"[bold]=>[/bold] Created run directory: {run_dir}")
+
+        algorithm_name = get_algorithm_name(run_name)
+
+        # Generate default run configuration
+        run = {
+            "name": run_name,
+            "title": f"Run configuration for {algorithm_name}",
+            "profile": "datakit-run",
+            "algorithm": f"{algorithm_name}",
+            "container": f'{algorithm["container"]}',
+            "data": {
+                "inputs": [],
+                "outputs": [],
+            },
+        }
+
+        resource_names = []
+
+        # Create run configuration and collect associated resources
+        for variable in algorithm["signature"]["inputs"]:
+            # Add variable defaults to run configuration
+            run["data"]["inputs"].append(
+                {
+                    "name": variable["name"],
+                    **variable["default"],
+                }
+            )
+
+            if variable["type"] == "resource":
+                resource_names.append(variable["default"]["resource"])
+
+        for variable in algorithm["signature"]["outputs"]:
+            # Add variable defaults to run configuration
+            run["data"]["outputs"].append(
+                {
+                    "name": variable["name"],
+                    **variable["default"],
+                }
+            )
+
+            if variable["type"] == "resource":
+                resource_names.append(variable["default"]["resource"])
+
+        # Write generated configuration
+        write_run_configuration(run, base_path=self.path)
+
+        self.echo(
+            f"[bold]=>[/bold] Generated default run configuration: {run_name}"
+        )
+
+        return resource_names
+
+    def reset(self) -> None:
+        """Reset datakit to clean state
+
+        Removes all run outputs and resets configurations to default
+        """
+        # Remove all run directories
+        for f in os.scandir(self.path):
+            if f.is_dir() and f.path.endswith(RUN_EXTENSION):
+                self.echo(f"[bold]=>[/bold] Deleting [bold]{f.name}[/bold]")
+                shutil.rmtree(f.path)
+
+        # Remove all run references from datakit.json
+        with self.edit_configuration() as datakit:
+            datakit["runs"] = []
+
+        # Remove content-addressed store
+        if os.path.exists(self.store_dir):
+            shutil.rmtree(self.store_dir)
+
+        # Remove CLI config
+        if os.path.exists(self.config_file):
+            os.remove(self.config_file)
+
+    def gc(
+        self,
+        keep_last: Optional[int] = None,
+        max_age: Optional[float] = None,
+        max_size: Optional[float] = None,
+        dry_run: bool = False,
+    ) -> dict:
+        """Delete old runs and unused stored files
+
+        Keeps the keep_last most recent runs per algorithm, deletes runs not
+        modified in max_age days, and deletes the oldest runs until the total
+        run size is under max_size megabytes. The active run is never
+        deleted.
+
+        Returns a dict of deleted run names to their size in bytes and the
+        number of bytes freed from the store
+        """
+        active_run = self.active_run
+        active_run = active_run.name if active_run else None
+
+        runs = {}
+        for f in os.scandir(self.path):
+            if f.is_dir() and f.path.endswith(RUN_EXTENSION):
+                runs[f.name] = get_run_info(f.path)
+
+        # Newest first
+        run_names = sorted(
+            runs, key=lambda r: runs[r]["modified"], reverse=True
+        )
+        to_delete = []
+
+        if keep_last is not None:
+            kept = {}
+            for run_name in run_names:
+                algorithm_name = get_algorithm_name(run_name)
+                kept[algorithm_name] = kept.get(algorithm_name, 0) + 1
+                if kept[algorithm_name] > keep_last:
+                    to_delete.append(run_name)
+
+        if max_age is not None:
+            cutoff = time.time() - max_age * 24 * 60 * 60
+            to_delete += [
+                r
+                for r in run_names
+                if runs[r]["modified"] < cutoff and r not in to_delete
+            ]
+
+        if max_size is not None:
+            total_size = sum(
+                runs[r]["size"] for r in run_names if r not in to_delete
+            )
+            for run_name in reversed(run_names):
+                if total_size <= max_size * 1024 * 1024:
+                    break
+                if run_name not in to_delete and run_name != active_run:
+                    to_delete.append(run_name)
+                    total_size -= runs[run_name]["size"]
+
+        to_delete = [r for r in to_delete if r != active_run]
+
+        action = "Would delete" if dry_run else "Deleting"
+        for run_name in to_delete:
+            self.echo(
+                f"[bold]=>[/bold] {action} [bold]{run_name}[/bold] "
+                f"({format_size(runs[run_name]['size'])})"
+            )
+
+        if dry_run:
+            return {
+                "deleted": {r: runs[r]["size"] for r in to_delete},
+                "freed": 0,
+            }
+
+        def delete_run(run_name: str) -> bool:
+            """Delete a run directory, returning False if the run is in use"""
+            run = Run(self, run_name)
+            deleted_dir = f"{self.path}/.{run_name}.{os.getpid()}.deleted"
+
+            try:
+                with run.lock(blocking=False):
+                    # Move the run aside while holding its lock, so anyone
+                    # waiting for the lock finds the run gone once it's freed
+                    os.rename(run.path, deleted_dir)
+            except BlockingIOError:
+                self.echo(
+                    f"[yellow]Skipping {run_name} as it is in use[/yellow]"
+                )
+                return False
+            except RunNotFoundError:
+                # Already deleted by another dk process
+                return True
+
+            shutil.rmtree(deleted_dir)
+
+            return True
+
+        # Delete run directories in parallel
+        with ThreadPoolExecutor() as executor:
+            deleted = [
+                run_name
+                for run_name, success in zip(
+                    to_delete, executor.map(delete_run, to_delete)
+                )
+                if success
+            ]
+
+        # Remove deleted run references from datakit.json
+        with self.edit_configuration() as datakit:
+            datakit["runs"] = [r for r in datakit["runs"] if r not in deleted]
+
+        return {
+            "deleted": {r: runs[r]["size"] for r in deleted},
+            "freed": self.prune_store(),
+        }
+
+    def export(
+        self,
+        variable_names: List[str],
+        runs: Optional[List["Run"]] = None,
+        max_workers: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """Gather variable values from many runs into a single DataFrame
+
+        Runs default to all runs in the datakit and are read in parallel.
+        Values are laid out as in Run.to_frame(), with a leading "run" column
+        naming the run each row came from, so a variable named "run" can't
+        be exported.
+        """
+        if "run" in variable_names:
+            raise VariableError(
+                'Variables named "run" can\'t be exported, as they would '
+                'clash with the "run" column'
+            )
+
+        if runs is None:
+            runs = self.runs
+
+        def load_run(run: Run) -> pd.DataFrame:
+            frame = run.to_frame(variable_names)
+            frame.insert(0, "run", run.name)
+            return frame
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(executor.map(load_run, runs))
+
+        if not frames:
+            return pd.DataFrame(columns=["run", *variable_names])
+
+        return pd.concat(frames, ignore_index=True)
+
+    # Content-addressed store
+
+    def store_file(self, path: str) -> None:
+        """Move a file into the content-addressed store
+
+        The file is replaced by a hard link to the stored object, so identical
+        files across runs share a single copy on disk. Stored objects are made
+        read-only to guard against in-place modification, so runs must be
+        detached with Run.detach() before their outputs are written to.
+        """
+        with open(path, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+
+        object_path = f"{self.store_dir}/{digest[:2]}/{digest}"
+
+        try:
+            if not os.path.exists(object_path):
+                # First copy of this content, adopt it as the stored object
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.link(path, object_path)
+                os.chmod(
+                    object_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+                )
+            elif not os.path.samefile(path, object_path):
+                # Replace the file with a link to the existing object
+                os.link(object_path, path + ".tmp")
+                os.replace(path + ".tmp", path)
+        except OSError:
+            # Hard links aren't supported here, keep the private copy
+            pass
+
+    def prune_store(self) -> int:
+        """Delete stored objects no longer referenced by any run, and any
+        prefix directories left empty
+
+        Returns the number of bytes freed
+        """
+        freed = 0
+
+        if not os.path.exists(self.store_dir):
+            return freed
+
+        for prefix in os.scandir(self.store_dir):
+            for f in os.scandir(prefix.path):
+                info = f.stat()
+                if info.st_nlink == 1:
+                    # Only the store references this object
+                    os.remove(f.path)
+                    freed += info.st_size
+
+            try:
+                os.rmdir(prefix.path)
+            except OSError:
+                # Still holds objects referenced by other runs
+                pass
+
+        return freed
+
+
+class Run:
+    """A run of a datakit algorithm
+
+    Run names are full run directory names, i.e. [algorithm].[name].run
+    """
+
+    def __init__(self, datakit: Datakit, name: str):
+        self.datakit = datakit
+        self.name = name
+        self.path = RUN_DIR.format(base_path=datakit.path, run_name=name)
+
+    def __repr__(self) -> str:
+        return f"Run({self.name!r})"
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, Run)
+            and self.datakit.path == other.datakit.path
+            and self.name == other.name
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.datakit.path, self.name))
+
+    @property
+    def algorithm(self) -> str:
+        """Name of the run algorithm"""
+        return get_algorithm_name(self.name)
+
+    @property
+    def configuration(self) -> dict:
+        """The run configuration"""
+        return load_run_configuration(self.name, base_path=self.datakit.path)
+
+    @contextmanager
+    def lock(self, blocking: bool = True, shared: bool = False):
+        """Lock the run directory against concurrent modification
+
+        Run files are written in place, so readers take a shared lock to
+        avoid seeing partially written files. RunNotFoundError is raised if
+        the run doesn't exist, or was deleted while waiting for the lock.
+        """
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(
+                    lock(
+                        RUN_LOCK_FILE.format(run_dir=self.path),
+                        blocking=blocking,
+                        shared=shared,
+                    )
+                )
+            except FileNotFoundError:
+                raise RunNotFoundError(f"{self.name} does not exist")
+
+            yield
+
+    def get_signature(self, variable_name: str) -> dict:
+        """Return the algorithm signature of a variable"""
+        return self.datakit.get_variable_signature(self.name, variable_name)
+
+    def get_view_artefact_path(self, view_name: str) -> str:
+        """Return the path of a rendered view's pickled figure
+
+        Compressed artefacts have a .zst extension
+        """
+        path = (
+            VIEW_ARTEFACTS_DIR.format(
+                base_path=self.datakit.path, run_name=self.name
+            )
+            + f"/{view_name}.p"
+        )
+
+        if os.path.exists(path + COMPRESSED_EXTENSION):
+            return path + COMPRESSED_EXTENSION
+
+        return path
+
+    # Content-addressed store
+
+    def store(self) -> None:
+        """Deduplicate output resources and view artefacts into the store
+
+        Input resources are never stored, as they are written in place by
+        datakitpy, relationships and users editing them by hand, which would
+        modify every run sharing them. Any input resources shared by older
+        versions of dk are detached.
+        """
+        outputs = self._get_output_resources()
+
+        for f in os.scandir(f"{self.path}/resources"):
+            if (
+                f.is_file()
+                and os.path.splitext(f.name)[0] in outputs
+                and f.stat().st_nlink == 1
+            ):
+                self.datakit.store_file(f.path)
+
+        for f in os.scandir(f"{self.path}/views"):
+            if f.is_file() and f.stat().st_nlink == 1:
+                self.datakit.store_file(f.path)
+
+        self.detach_inputs()
+
+    def _get_output_resources(self) -> set:
+        """Return the names of the run's output resources"""
+        signature = self.datakit.load_index()["algorithms"][self.algorithm][
+            "signature"
+        ]
+        return {
+            variable["default"]["resource"]
+            for variable in signature["outputs"]
+            if variable["type"] == "resource"
+        }
+
+    def detach_inputs(self) -> None:
+        """Replace input resources shared by older versions of dk with
+        private, writable copies
+
+        Input resources are never stored, so this leaves shared outputs and
+        view artefacts alone and is cheap to call before writing inputs.
+        """
+        outputs = self._get_output_resources()
+
+        for f in os.scandir(f"{self.path}/resources"):
+            if (
+                f.is_file()
+                and os.path.splitext(f.name)[0] not in outputs
+                and f.stat().st_nlink > 1
+            ):
+                detach_file(f.path)
+
+    def detach(self) -> None:
+        """Replace stored files with private, writable copies
+
+        Only needed before outputs or view artefacts are written, i.e. before
+        executing the run or rendering a view
+        """
+        for subdir in STORED_RUN_DIRS:
+            for f in os.scandir(f"{self.path}/{subdir}"):
+                if f.is_file() and f.stat().st_nlink > 1:
+                    detach_file(f.path)
+
+    # Variables
+
+    def show(self, variable_name: str) -> Any:
+        """Return a variable value
+
+        Resource variables are returned as TabularDataResource objects
+        """
+        # Load algorithum signature to check variable type
+        signature = self.get_signature(variable_name)
+
+        with self.lock(shared=True):
+            if signature["type"] == "resource":
+                # Variable is a tabular data resource
+                return load_resource_by_variable(
+                    run_name=self.name,
+                    variable_name=variable_name,
+                    base_path=self.datakit.path,
+                )
+            else:
+                # Variable is a simple string/number/bool value
+                return load_variable(
+                    run_name=self.name,
+                    variable_name=variable_name,
+                    base_path=self.datakit.path,
+                )["value"]
+
+    def to_frame(self, variable_names: List[str]) -> pd.DataFrame:
+        """Return variable values as a DataFrame
+
+        Resource variables contribute their table columns, named
+        [variable name].[column name] and joined on the table index. Simple
+        values become columns repeated on every row.
+        """
+        with self.lock(shared=True):
+            configuration = self.configuration
+            variables = (
+                configuration["data"]["inputs"]
+                + configuration["data"]["outputs"]
+            )
+
+            values, tables = {}, []
+
+            for variable_name in variable_names:
+                if self.get_signature(variable_name)["type"] == "resource":
+                    data = load_resource_by_variable(
+                        run_name=self.name,
+                        variable_name=variable_name,
+                        base_path=self.datakit.path,
+                    ).data
+                    tables.append(data.add_prefix(f"{variable_name}."))
+                else:
+                    values[variable_name] = find_by_name(
+                        variables, variable_name
+                    )["value"]
+
+        if not tables:
+            return pd.DataFrame([values])
+
+        tables = pd.concat(tables, axis=1)
+
+        return pd.concat(
+            [pd.DataFrame(values, index=tables.index), tables], axis=1
+        )
+
+    def compare(
+        self,
+        other: "Run",
+        variable_names: Optional[List[str]] = None,
+        rtol: float = 1e-05,
+        atol: float = 1e-08,
+    ) -> pd.DataFrame:
+        """Return the values that differ between this run and another
+
+        Variables default to all inputs and outputs. Numbers are compared with
+        numpy.isclose using the given tolerances. Returns a DataFrame with
+        one row per differing value, with columns variable, row, column (None
+        for simple values), a (this run's value) and b (the other run's).
+        """
+        if self.algorithm != other.algorithm:
+            raise VariableError(
+                f"{self.name} and {other.name} are runs of different "
+                "algorithms"
+            )
+
+        if variable_names is None:
+            variable_names = list(
+                self.datakit.load_index()["algorithms"][self.algorithm][
+                    "variables"
+                ]
+            )
+
+        with self.lock(shared=True), other.lock(shared=True):
+            return self._compare(other, variable_names, rtol, atol)
+
+    def _compare(
+        self,
+        other: "Run",
+        variable_names: List[str],
+        rtol: float,
+        atol: float,
+    ) -> pd.DataFrame:
+        configurations = [self.configuration, other.configuration]
+        diffs = []
+
+        for variable_name in variable_names:
+            if self.get_signature(variable_name)["type"] == "resource":
+                a, b = [
+                    load_resource_by_variable(
+                        run_name=run.name,
+                        variable_name=variable_name,
+                        base_path=self.datakit.path,
+                    ).data
+                    for run in [self, other]
+                ]
+                diff = diff_frames(a, b, rtol, atol)
+            else:
+                a, b = [
+                    find_by_name(
+                        c["data"]["inputs"] + c["data"]["outputs"],
+                        variable_name,
+                    )["value"]
+                    for c in configurations
+                ]
+                diff = diff_frames(
+                    pd.DataFrame({"value": [a]}),
+                    pd.DataFrame({"value": [b]}),
+                    rtol,
+                    atol,
+                ).assign(row=None, column=None)
+
+            diff.insert(0, "variable", variable_name)
+            diffs.append(diff)
+
+        if not diffs:
+            return pd.DataFrame(
+                columns=["variable", "row", "column", "a", "b"]
+            )
+
+        return pd.concat(diffs, ignore_index=True)
+
+    def set(self, variable_ref: str, variable_value: Any) -> str:
+        """Set a variable or table value
+
+        variable_ref is either a variable name, or a table reference in the
+        format [resource name].[primary key].[column name]. Returns the name
+        of the variable that was set.
+        """
+        echo = self.datakit.echo
+
+        with self.lock():
+            self.detach_inputs()
+
+            if "." in variable_ref:
+                # Variable reference is a table reference
+
+                # Check the variable_ref matches the pattern:
+                # [resource].[primary key].[column]
+                pattern = re.compile(
+                    r"^([a-zA-Z0-9_]+)\.([a-zA-Z0-9_]+)\.([a-zA-Z0-9_]+)$"
+                )
+
+                if not pattern.match(variable_ref):
+                    raise VariableError(
+                        "Variable name argument must be either a variable "
+                        "name or a table reference in the format "
+                        "[resource name].[primary key].[column name]"
+                    )
+
+                # Parse variable and row/col names
+                variable_name, row_name, col_name = variable_ref.split(".")
+
+                # Load param resource
+                resource = load_resource_by_variable(
+                    run_name=self.name,
+                    variable_name=variable_name,
+                    base_path=self.datakit.path,
+                )
+
+                # Check it's a tabular data resource
+                if resource.profile != "tabular-data-resource":
+                    raise VariableError(
+                        f"Resource {resource.name} is not of type "
+                        '"tabular-data-resource"'
+                    )
+
+                # If data is not populated, something has gone wrong
+                if not resource:
+                    raise VariableError(
+                        f'Parameter resource {resource.name} "data" field is '
+                        'empty. Try running "dk reset"?'
+                    )
+
+                echo(
+                    "[bold]=>[/bold] Setting table value at row "
+                    f"[bold]{row_name}[/bold] and column [bold]{col_name}"
+                    f"[/bold] to [bold]{variable_value}[/bold]"
+                )
+
+                # Set table value
+                try:
+                    # This will generate a key error if row_name doesn't exist
+                    # The assignment doesn't unfortunately
+                    resource.data.loc[row_name]  # Ensure row exists
+                    resource.data.loc[row_name, col_name] = variable_value
+                except KeyError:
+                    raise VariableError(
+                        f'Could not find row "{row_name}" or column '
+                        f'"{col_name}" in resource {resource.name}'
+                    )
+
+                # Write resource
+                write_resource(
+                    run_name=self.name,
+                    resource=resource,
+                    base_path=self.datakit.path,
+                )
+
+                echo(
+                    "[bold]=>[/bold] Successfully set table value at row "
+                    f"[bold]{row_name}[/bold] and column [bold]{col_name}"
+                    f"[/bold] to [bold]{variable_value}[/bold] in resource "
+                    f"[bold]{resource.name}[/bold]"
+                )
+            else:
+                # Variable reference is a simple variable name
+                variable_name = variable_ref
+
+                # Load variable signature
+                signature = self.get_signature(variable_name)
+
+                # Convenience dict mapping datakit types to Python types
+                type_map = {
+                    "string": [str],
+                    "boolean": [bool],
+                    "number": [float, int],
+                }
+
+                # Check the value is of the expected type for this variable
+                # Raise some helpful errors
+                if signature.get("profile") == "tabular-data-resource":
+                    raise VariableError(
+                        'Use command "load" for tabular data resource'
+                    )
+                elif "parameter-tabular-data-resource" in signature.get(
+                    "profile", ""
+                ):
+                    raise VariableError(
+                        'Use command "set-param" for parameter resource'
+                    )
+                # Specify False as fallback value here to avoid "None"s
+                # leaking through
+                elif not (
+                    type(variable_value) in type_map.get(signature["type"], [])
+                ):
+                    raise VariableError(
+                        f"Variable value must be of type {signature['type']}"
+                    )
+
+                # If this variable has an enum, check the value is allowed
+                if signature.get("enum", False):
+                    allowed_values = [i["value"] for i in signature["enum"]]
+                    if variable_value not in allowed_values:
+                        raise VariableError(
+                            f"Variable value must be one of {allowed_values}"
+                        )
+
+                # Check if nullable
+                if not signature["null"]:
+                    if not variable_value:
+                        raise VariableError("Variable value cannot be null")
+
+                # Load run configuration
+                run = self.configuration
+
+                # Set variable value
+                find_by_name(
+                    run["data"]["inputs"] + run["data"]["outputs"],
+                    variable_name,
+                )["value"] = variable_value
+
+                # Write configuration
+                write_run_configuration(run, base_path=self.datakit.path)
+
+                # Execute any relationships applied to this variable value
+                self.execute_relationship(variable_name)
+
+                echo(
+                    "[bold]=>[/bold] Successfully set "
+                    f"[bold]{variable_name}[/bold] variable"
+                )
+
+        return variable_name
+
+    def load(self, variable_name: str, data: Union[str, pd.DataFrame]) -> None:
+        """Load data into a resource variable
+
+        data is either a path to a CSV file or a DataFrame
+        """
+        with self.lock():
+            self.detach_inputs()
+
+            # Load resource into TabularDataResource object
+            resource = load_resource_by_variable(
+                run_name=self.name,
+                variable_name=variable_name,
+                base_path=self.datakit.path,
+            )
+
+            if isinstance(data, pd.DataFrame):
+                resource.data = data
+            else:
+                # Read CSV into resource
+                self.datakit.echo(f"[bold]=>[/bold] Reading {data}")
+                resource.data = pd.read_csv(data)
+
+            # Write to resource
+            write_resource(
+                run_name=self.name,
+                resource=resource,
+                base_path=self.datakit.path,
+            )
+
+            # Execute any applicable relationships
+            self.execute_relationship(variable_name)
+
+    def execute_relationship(self, variable_name: str) -> None:
+        """Execute any relationships applied to the given source variable
+
+        Relationships write run files in place, so the run is locked and any
+        legacy shared input resources are detached first.
+        """
+        with self.lock():
+            self.detach_inputs()
+            self._execute_relationship(variable_name)
+
+    def _execute_relationship(self, variable_name: str) -> None:
+        echo = self.datakit.echo
+        base_path = self.datakit.path
+
+        # Load run configuration for modification
+        run = self.configuration
+
+        echo(
+            "[bold]=>[/bold] Executing relationship for variable "
+            f"{variable_name}"
+        )
+
+        # Load associated relationship
+        relationship = (
+            self.datakit.load_index()["relationships"]
+            .get(self.algorithm, {})
+            .get(variable_name)
+        )
+
+        if relationship is None:
+            # No relationship for specified variable found, return
+            return
+
+        # Apply relationship rules
+        for rule in relationship["rules"]:
+            if rule["type"] == "change":
+                # Currently the only type of "change" rule we have is one that
+                # mirrors the schema from the source to other resources, so
+                # assume this is the case here
+
+                # TODO: This will need to change in the future
+
+                source = load_resource_by_variable(
+                    run_name=self.name,
+                    variable_name=variable_name,
+                    base_path=base_path,
+                    as_dict=True,
+                )
+
+                for target in rule["targets"]:
+                    update_resource(
+                        run_name=self.name,
+                        resource_name=target["name"],
+                        schema=source["schema"],
+                        base_path=base_path,
+                    )
+
+            elif rule["type"] == "value":
+                # Check if this rule applies to current run configuration state
+
+                # Get source variable value
+                value = load_variable(
+                    run_name=self.name,
+                    variable_name=variable_name,
+                    base_path=base_path,
+                )["value"]
+
+                # If the source variable value matches the rule value, execute
+                # the relationship
+                if value in rule["values"]:
+                    for target in rule["targets"]:
+                        if "disabled" in target:
+                            # Set target variable disabled value
+                            target_variable = load_variable(
+                                run_name=self.name,
+                                variable_name=target["name"],
+                                base_path=base_path,
+                            )
+
+                            target_variable["disabled"] = target["disabled"]
+
+                        if target["type"] == "resource":
+                            # Set target resource data and schema
+                            target_resource = load_resource_by_variable(
+                                run_name=run["name"],
+                                variable_name=target["name"],
+                                base_path=base_path,
+                                as_dict=True,
+                            )
+
+                            if "data" in target:
+                                echo(
+                                    " [bold]*[/bold] Setting "
+                                    f"{target_resource['name']} data"
+                                )
+                                target_resource["data"] = target["data"]
+
+                            if "schema" in target:
+                                echo(
+                                    " [bold]*[/bold] Setting "
+                                    f"{target_resource['name']} schema"
+                                )
+                                target_resource["schema"] = target["schema"]
+
+                            write_resource(
+                                run_name=run["name"],
+                                resource=target_resource,
+                                base_path=base_path,
+                            )
+                        elif target["type"] == "value":
+                            # Set target variable value
+                            target_variable = find_by_name(
+                                run["data"]["inputs"] + run["data"]["outputs"],
+                                target["name"],
+                            )
+
+                            if "value" in target:
+                                echo(
+                                    " [bold]*[/bold] Setting "
+                                    f"{target['name']} "
+                                    f"value from {target_variable['value']} "
+                                    f"to {target['value']}"
+                                )
+                                target_variable["value"] = target["value"]
+
+                            if "metaschema" in target:
+                                echo(
+                                    " [bold]*[/bold] Setting "
+                                    f"{target['name']} "
+                                    "metaschema from "
+                                    f"{target_variable['metaschema']} "
+                                    f"to {target['metaschema']}"
+                                )
+                                target_variable["metaschema"] = target[
+                                    "metaschema"
+                                ]
+                        else:
+                            raise NotImplementedError(
+                                (
+                                    'Only "resource" and "value" type rule '
+                                    "targets are implemented"
+                                )
+                            )
+
+            else:
+                raise NotImplementedError(
+                    "Only value-based rules are implemented"
+                )
+
+        # Write modified run configuration
+        write_run_configuration(run, base_path=base_path)
+
+    # Execution
+
+    def execute(self, docker_client: Optional[Any] = None) -> str:
+        """Execute the run algorithm container
+
+        Returns the container logs
+        """
+        with self.lock():
+            # The container writes outputs in place, so unshare stored files
+            # first
+            self.detach()
+
+            try:
+                logs = execute_datakit(
+                    docker_client or get_docker_client(),
+                    self.name,
+                    base_path=self.datakit.path,
+                )
+            except ExecutionError as e:
+                raise RunExecutionError("Container execution failed", e.logs)
+
+            self.store()
+
+        return logs
+
+    def view(self, view_name: str, docker_client: Optional[Any] = None) -> str:
+        """Generate a view artefact by executing the view container
+
+        Returns the container logs
+        """
+        with self.lock():
+            self.detach()
+
+            try:
+                logs = execute_view(
+                    docker_client=docker_client or get_docker_client(),
+                    run_name=self.name,
+                    view_name=view_name,
+                    base_path=self.datakit.path,
+                )
+            except ResourceError as e:
+                raise ViewError(e.message)
+            except ExecutionError as e:
+                raise RunExecutionError("View execution failed", e.logs)
+
+            # The container writes an uncompressed artefact, replacing any
+            # compressed artefact from a previous render
+            path = self.get_view_artefact_path(view_name)
+            if path.endswith(COMPRESSED_EXTENSION):
+                path = path[: -len(COMPRESSED_EXTENSION)]
+                os.remove(path + COMPRESSED_EXTENSION)
+
+            if self.datakit.compression_level is not None:
+                compress_file(path, self.datakit.compression_level)
+
+            self.store()
+
+        return logs
+
+    def load_view(self, view_name: str):
+        """Load a generated view as a matplotlib figure"""
+        with self.lock(shared=True):
+            path = self.get_view_artefact_path(view_name)
+
+            if path.endswith(COMPRESSED_EXTENSION):
+                f = open_compressed(path)
+            else:
+                f = open(path, "rb")
+
+            with f:
+                # NOTE: The matplotlib version in CLI must be >= the version
+                # of matplotlib used to generate the plot (which is chosen by
+                # the user) So the CLI should be kept up to date at all times
+                return pickle.load(f)
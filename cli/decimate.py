@@ -0,0 +1,156 @@
+import numpy as np
+
+
+def minmax_decimate(y, n_buckets: int):
+    """Return indices of the min and max point in each of n_buckets buckets
+
+    Points are split into equally sized buckets by index (i.e. one bucket per
+    horizontal pixel for evenly sampled series), and the indices of the
+    minimum and maximum y value in each bucket are returned in order, so
+    peaks are preserved when the decimated line is drawn.
+    """
+    y = np.asarray(y, dtype=float)
+    bucket_size = len(y) // n_buckets
+
+    if bucket_size < 2:
+        # Nothing to gain from decimating
+        return np.arange(len(y))
+
+    # Reshape the bulk of the series into buckets, handling the remainder
+    # separately so we don't need to pad
+    n_full = bucket_size * n_buckets
+    buckets = y[:n_full].reshape(n_buckets, bucket_size)
+
+    # Ignore NaNs unless the whole bucket is NaN
+    offsets = np.arange(n_buckets) * bucket_size
+    mins = np.where(np.isnan(buckets), np.inf, buckets).argmin(axis=1)
+    maxs = np.where(np.isnan(buckets), -np.inf, buckets).argmax(axis=1)
+
+    # Keep each min/max pair in x order so the line doesn't double back
+    indices = np.sort(np.stack([mins, maxs], axis=1), axis=1)
+    indices = (indices + offsets[:, None]).ravel()
+
+    if n_full < len(y):
+        indices = np.concatenate([indices, np.arange(n_full, len(y))])
+
+    return np.unique(indices)
+
+
+def pixel_decimate(offsets, xlim, ylim, width: int, height: int):
+    """Return indices of one scatter point per occupied pixel"""
+    x, y = offsets[:, 0], offsets[:, 1]
+
+    # Only consider points within the current view limits
+    visible = np.flatnonzero(
+        (x >= min(xlim))
+        & (x <= max(xlim))
+        & (y >= min(ylim))
+        & (y <= max(ylim))
+    )
+
+    # Bin visible points into pixel cells and keep the first in each cell,
+    # guarding against zero-width limits (e.g. a single point or flat line)
+    xspan = max(np.ptp(xlim), np.finfo(float).tiny)
+    yspan = max(np.ptp(ylim), np.finfo(float).tiny)
+    col = ((x[visible] - min(xlim)) / xspan * (width - 1)).astype(int)
+    row = ((y[visible] - min(ylim)) / yspan * (height - 1)).astype(int)
+    _, first = np.unique(row * width + col, return_index=True)
+
+    return np.sort(visible[first])
+
+
+class FigureDecimator:
+    """Downsample large line and scatter artists in a matplotlib figure
+
+    Full resolution data is kept in memory and re-decimated for the visible
+    range whenever an axis is zoomed or panned.
+    """
+
+    def __init__(self, figure, min_points: int):
+        self.figure = figure
+        self.min_points = min_points
+        self.lines = {}  # Line2D -> (x, y, x is sorted)
+        self.collections = {}  # PathCollection -> (offsets, per-point props)
+
+    def attach(self) -> int:
+        """Decimate all large artists and connect zoom callbacks
+
+        Returns the total number of points in the figure
+        """
+        total_points = 0
+
+        for ax in self.figure.axes:
+            decimated = False
+
+            for line in ax.get_lines():
+                # Use unit-converted data so limits can be compared directly
+                x = np.asarray(line.get_xdata(orig=False), dtype=float)
+                y = np.asarray(line.get_ydata(orig=False), dtype=float)
+                total_points += len(y)
+
+                if len(y) > self.min_points:
+                    self.lines[line] = (x, y, bool(np.all(np.diff(x) >= 0)))
+                    decimated = True
+
+            for collection in ax.collections:
+                offsets = np.asarray(collection.get_offsets())
+                total_points += len(offsets)
+
+                if len(offsets) > self.min_points:
+                    self.collections[collection] = (
+                        offsets,
+                        self._per_point_properties(collection, len(offsets)),
+                    )
+                    decimated = True
+
+            if decimated:
+                self.update(ax)
+                ax.callbacks.connect("xlim_changed", self.update)
+                ax.callbacks.connect("ylim_changed", self.update)
+
+        return total_points
+
+    @staticmethod
+    def _per_point_properties(collection, n_points: int) -> dict:
+        """Collect collection properties that must be subset with offsets"""
+        properties = {}
+
+        for name in ["sizes", "facecolors", "edgecolors", "array"]:
+            value = getattr(collection, f"get_{name}")()
+            if value is not None and len(value) == n_points:
+                properties[name] = np.asarray(value)
+
+        return properties
+
+    def update(self, ax) -> None:
+        """Re-decimate the artists of ax for its current view limits"""
+        bbox = ax.get_window_extent()
+        width, height = max(int(bbox.width), 1), max(int(bbox.height), 1)
+        xlim, ylim = ax.get_xlim(), ax.get_ylim()
+
+        for line, (x, y, is_sorted) in self.lines.items():
+            if line.axes is not ax:
+                continue
+
+            if is_sorted:
+                # Select the visible range (plus one point either side so the
+                # line reaches the axes edges)
+                start = max(np.searchsorted(x, min(xlim)) - 1, 0)
+                stop = np.searchsorted(x, max(xlim), side="right") + 1
+            else:
+                start, stop = 0, len(x)
+
+            indices = start + minmax_decimate(y[start:stop], width)
+            line.set_data(x[indices], y[indices])
+
+        for collection, (offsets, props) in self.collections.items():
+            if collection.axes is not ax:
+                continue
+
+            indices = pixel_decimate(offsets, xlim, ylim, width, height)
+            collection.set_offsets(offsets[indices])
+
+            for name, value in props.items():
+                getattr(collection, f"set_{name}")(value[indices])
+
+        ax.figure.canvas.draw_idle()
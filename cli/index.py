@@ -0,0 +1,198 @@
+import os
+import json
+import threading
+from typing import Any, List, Optional, Union
+
+# Shell completion reads datakit metadata through this module, so it must
+# not import anything slow. Notably datakitpy pulls in pandas and docker, so
+# is only imported when the index has to be rebuilt.
+
+CONFIG_FILE = "{base_path}/.datakit"
+DATAKIT_FILE = "{base_path}/datakit.json"
+INDEX_FILE = "{base_path}/.datakit-index"  # Compiled datakit metadata
+RUN_EXTENSION = ".run"
+DEFAULT_COMPRESSION = {"level": 3}  # zstd settings if datakit.json has none
+COMPRESSION_LEVELS = range(-(1 << 17), 23)  # Levels accepted by zstd
+
+
+def write_json(path: str, data: Any) -> None:
+    """Atomically write data to a JSON file
+
+    Data is written to a temporary file which is then renamed over path, so
+    readers never see a partially written file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+
+    os.replace(tmp_path, path)
+
+
+def get_source_stamps(sources: list) -> dict:
+    """Return the modification time and size of each source path"""
+    stamps = {}
+
+    for path in sources:
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            continue
+        stamps[path] = [info.st_mtime_ns, info.st_size]
+
+    return stamps
+
+
+def get_run_names(base_path: str) -> List[str]:
+    """Return the names of all run directories in a datakit"""
+    return sorted(
+        f.name
+        for f in os.scandir(base_path)
+        if f.name.endswith(RUN_EXTENSION) and f.is_dir()
+    )
+
+
+def get_active_run_name(base_path: str) -> Optional[str]:
+    """Return the name of the active run, or None if no run is active"""
+    try:
+        with open(CONFIG_FILE.format(base_path=base_path), "r") as f:
+            return json.load(f)["run"]
+    except FileNotFoundError:
+        return None
+
+
+def get_index_sources(base_path: str, datakit: dict) -> list:
+    """Return the paths of all files and directories the index is built from
+
+    Algorithm directories are included so added or removed files (e.g.
+    relationship files) invalidate the index. The datakit directory isn't,
+    as dk writes its own files and runs there.
+    """
+    sources = [DATAKIT_FILE.format(base_path=base_path)]
+
+    for algorithm_name in datakit["algorithms"]:
+        algorithm_dir = f"{base_path}/{algorithm_name}"
+        sources.append(algorithm_dir)
+        sources += sorted(
+            f.path
+            for f in os.scandir(algorithm_dir)
+            if f.is_file() and f.name.endswith(".json")
+        )
+
+    return sources
+
+
+def get_compression(datakit: dict) -> Union[dict, bool]:
+    """Validate and return the compression settings of a datakit
+
+    Compression may be true or false to use the default settings or disable
+    compression, or a dict with an integer zstd "level".
+    """
+    compression = datakit.get("compression", DEFAULT_COMPRESSION)
+
+    if compression is True:
+        return DEFAULT_COMPRESSION
+
+    if compression is False or (
+        isinstance(compression, dict)
+        and isinstance(compression.get("level"), int)
+        and not isinstance(compression["level"], bool)
+        and compression["level"] in COMPRESSION_LEVELS
+    ):
+        return compression
+
+    from cli.api import DatakitError
+
+    raise DatakitError(
+        "Invalid compression settings in datakit.json: "
+        f"{json.dumps(compression)}\n"
+        'Compression must be true, false or {"level": [level]}, with a zstd '
+        f"level from {COMPRESSION_LEVELS[0]} to {COMPRESSION_LEVELS[-1]}"
+    )
+
+
+def build_index(base_path: str) -> dict:
+    """Compile datakit metadata into a single index
+
+    The index contains the signature, variables and views of each algorithm
+    and relationships by source variable. Only the first relationship listed
+    for a source variable is applied, any later ones are ignored.
+    """
+    from datakitpy.datakit import (
+        load_datakit_configuration,
+        load_algorithm,
+        RELATIONSHIPS_FILE,
+    )
+
+    datakit = load_datakit_configuration(base_path=base_path)
+
+    index = {
+        "sources": get_source_stamps(get_index_sources(base_path, datakit)),
+        "algorithms": {},
+        "relationships": {},
+        "compression": get_compression(datakit),
+    }
+
+    for algorithm_name in datakit["algorithms"]:
+        algorithm = load_algorithm(algorithm_name, base_path=base_path)
+        signature = algorithm["signature"]
+
+        index["algorithms"][algorithm_name] = {
+            "signature": signature,
+            "variables": {
+                variable["name"]: {
+                    "type": variable["type"],
+                    "resource": variable["default"].get("resource"),
+                }
+                for variable in signature["inputs"] + signature["outputs"]
+            },
+            "views": [
+                view["name"] if isinstance(view, dict) else view
+                for view in algorithm.get("views", [])
+            ],
+        }
+
+        try:
+            with open(
+                RELATIONSHIPS_FILE.format(
+                    base_path=base_path, algorithm_name=algorithm_name
+                ),
+                "r",
+            ) as f:
+                relationships = json.load(f)["relationships"]
+        except FileNotFoundError:
+            relationships = []
+
+        # Relationships are looked up by source, keeping the first for each
+        index["relationships"][algorithm_name] = {}
+        for relationship in relationships:
+            index["relationships"][algorithm_name].setdefault(
+                relationship["source"], relationship
+            )
+
+    return index
+
+
+def load_index(base_path: str, index: Optional[dict] = None) -> dict:
+    """Load the datakit metadata index, rebuilding it if it is stale
+
+    A previously loaded index may be passed in to avoid re-reading it.
+    """
+    index_file = INDEX_FILE.format(base_path=base_path)
+
+    if index is None:
+        try:
+            with open(index_file, "r") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    # The index is valid if none of its sources have changed. Any new
+    # algorithm files will have changed their directory's stamp.
+    if index is None or index["sources"] != get_source_stamps(
+        index["sources"]
+    ):
+        index = build_index(base_path)
+        write_json(index_file, index)
+
+    return index
@@ -1,61 +1,90 @@
 import os
 import time
-import shutil
-import json
-import re
-import pickle
 import typer
-import docker
-import matplotlib
-import matplotlib.pyplot as plt
-import pandas as pd
 from ast import literal_eval
-from typing import Optional, Any
+from functools import cache, wraps
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import TYPE_CHECKING, Optional, Any, List
 from typing_extensions import Annotated
 from rich import print
+from rich.markup import escape
 from rich.panel import Panel
 from tabulate import tabulate
-from datakitpy.datakit import (
-    ExecutionError,
-    ResourceError,
-    execute_datakit,
-    execute_view,
-    init_resource,
-    load_resource_by_variable,
-    write_resource,
-    update_resource,
-    load_run_configuration,
-    write_run_configuration,
-    load_variable,
-    load_variable_signature,
-    load_datakit_configuration,
-    write_datakit_configuration,
-    load_algorithm,
-    write_algorithm,
-    get_algorithm_name,
-    RUN_DIR,
-    RELATIONSHIPS_FILE,
-    VIEW_ARTEFACTS_DIR,
+from cli.index import (
+    get_active_run_name,
+    get_run_names,
+    load_index,
+    write_json,
+    RUN_EXTENSION,
 )
-from datakitpy.helpers import find_by_name, find
 
-
-app = typer.Typer(no_args_is_help=True)
+# The Python API and other heavy dependencies (pandas, numpy, docker,
+# watchdog, yaml) are imported by the commands that need them, so shell
+# completion stays fast
+if TYPE_CHECKING:
+    from cli.api import Datakit, Run, DatakitError
 
 
-client = docker.from_env()
+app = typer.Typer(no_args_is_help=True)
+pipeline_app = typer.Typer(no_args_is_help=True)
+app.add_typer(
+    pipeline_app,
+    name="pipeline",
+    help="Execute multi-algorithm pipelines",
+)
 
 
 # Assume we are always at the datakit root
 # TODO: Validate we actually are, and that this is a datakit
 DATAKIT_PATH = os.getcwd()  # Root datakit path
-CONFIG_FILE = f"{DATAKIT_PATH}/.datakit"
-RUN_EXTENSION = ".run"
 
 
 # Helpers
 
 
+@cache
+def get_datakit() -> "Datakit":
+    """Return the datakit at DATAKIT_PATH
+
+    Commands are thin wrappers around the Python API, printing its progress
+    """
+    from cli.api import Datakit
+
+    return Datakit(DATAKIT_PATH, echo=print)
+
+
+def print_error(e: "DatakitError") -> None:
+    """Print a datakit error, including any container logs"""
+    from cli.api import RunExecutionError
+
+    if isinstance(e, RunExecutionError):
+        print(
+            Panel(
+                escape(e.logs),
+                title="[bold red]Execution error[/bold red]",
+            )
+        )
+
+    for line in str(e).splitlines():
+        print(f"[red]{escape(line)}[/red]")
+
+
+def handle_errors(command):
+    """Print datakit errors raised by a command and exit"""
+
+    @wraps(command)
+    def wrapper(*args, **kwargs):
+        from cli.api import DatakitError
+
+        try:
+            return command(*args, **kwargs)
+        except DatakitError as e:
+            print_error(e)
+            exit(1)
+
+    return wrapper
+
+
 def dumb_str_to_type(value) -> Any:
     """Parse a string to any Python type"""
     # Stupid workaround for Typer not supporting Union types :<
@@ -70,228 +99,149 @@ def dumb_str_to_type(value) -> Any:
             return value
 
 
-def get_default_algorithm() -> str:
-    """Return the default algorithm for the current datakit"""
-    return load_datakit_configuration(base_path=DATAKIT_PATH)["algorithms"][0]
-
-
-def load_config():
-    """Load CLI configuration file"""
-    with open(CONFIG_FILE, "r") as f:
-        return json.load(f)
+def load_manifest(path: str, dk: "Datakit") -> dict:
+    """Load a manifest of runs to initialise
 
+    CSV paths of resource inputs are relative to the manifest's directory.
+    Returns a dict of run name to input variable values
+    """
+    import yaml
 
-def get_active_run():
     try:
-        return load_config()["run"]
+        with open(path, "r") as f:
+            manifest = yaml.safe_load(f)
     except FileNotFoundError:
-        print('[red]No active run is set. Have you run "dk init"?[/red]')
+        print(f"[red]No manifest found at {path}[/red]")
+        exit(1)
+    except yaml.YAMLError as e:
+        print(f"[red]Could not parse manifest {path}: {escape(str(e))}[/red]")
         exit(1)
 
+    runs = {}
 
-def write_config(run_name):
-    """Write updated CLI configuration file"""
-    with open(CONFIG_FILE, "w") as f:
-        json.dump({"run": run_name}, f, indent=2)
+    for entry in (manifest or {}).get("runs", []):
+        if not isinstance(entry, dict) or "run" not in entry:
+            print(
+                '[red]Manifest entries must have a "run" name: '
+                f"{escape(str(entry))}[/red]"
+            )
+            exit(1)
 
+        if entry["run"] in runs:
+            print(f"[red]{entry['run']} is listed more than once[/red]")
+            exit(1)
 
-def run_exists(run_name):
-    """Check if specified run exists"""
-    run_dir = RUN_DIR.format(base_path=DATAKIT_PATH, run_name=run_name)
-    return os.path.exists(run_dir) and os.path.isdir(run_dir)
+        run_name = dk.get_full_run_name(entry["run"])
+        inputs = entry.get("inputs") or {}
 
+        for variable_name, value in inputs.items():
+            signature = dk.get_variable_signature(run_name, variable_name)
 
-def get_full_run_name(run_name):
-    """Validate and return full run name"""
-    if run_name is not None:
-        # Check the run_name matches the pattern [algorithm].[name] or
-        # [algorithm]
-        pattern = re.compile(r"^([a-zA-Z0-9_]+)\.([a-zA-Z0-9_]+)$")
+            if signature["type"] == "resource" and isinstance(value, str):
+                inputs[variable_name] = os.path.join(
+                    os.path.dirname(path), value
+                )
 
-        algorithms = load_datakit_configuration()["algorithms"]
+        runs[entry["run"]] = inputs
 
-        if not pattern.match(run_name) and run_name not in algorithms:
-            print(f'[red]"{run_name}" is not a valid run name[/red]')
-            print(
-                "[red]Run names must match the format: "
-                r"\[algorithm].\[name][/red]"
-            )
-            print(
-                "[red]Did you forget to add your algorithm to "
-                "datakit.json?[/red]"
-            )
-            exit(1)
+    return runs
 
-        algorithm_name = get_algorithm_name(run_name)
-        datakit_algorithms = load_datakit_configuration(
-            base_path=DATAKIT_PATH
-        )["algorithms"]
 
-        if get_algorithm_name(run_name) not in datakit_algorithms:
-            print(
-                f'[red]"{algorithm_name}" is not a valid datakit '
-                "algorithm[/red]"
-            )
-            print(
-                "[red]Available datakit algorithms: "
-                f"{datakit_algorithms}[/red]"
-            )
-            exit(1)
+def print_variable(run: "Run", variable_name: str) -> None:
+    """Print a variable value of the given run"""
+    value = run.show(variable_name)
 
-        return run_name + RUN_EXTENSION
+    if run.get_signature(variable_name)["type"] == "resource":
+        # Variable is a tabular data resource
+        print(
+            tabulate(
+                value.to_dict()["data"],
+                headers="keys",
+                tablefmt="rounded_grid",
+            )
+        )
     else:
-        return get_default_algorithm() + RUN_EXTENSION
-
+        # Variable is a simple string/number/bool value
+        print(
+            Panel(
+                str(value),
+                title=f"{variable_name}",
+                expand=False,
+            )
+        )
 
-def execute_relationship(run_name: str, variable_name: str) -> None:
-    """Execute any relationships applied to the given source variable"""
-    # Load run configuration for modification
-    run = load_run_configuration(run_name)
 
-    print(
-        f"[bold]=>[/bold] Executing relationship for variable {variable_name}"
-    )
+def load_completion_index() -> dict:
+    """Load the datakit index for shell completion
 
-    # Load associated relationship
+    Completion must never fail, so an empty index is returned if we aren't
+    in a datakit.
+    """
     try:
-        with open(
-            RELATIONSHIPS_FILE.format(
-                base_path=DATAKIT_PATH,
-                algorithm_name=get_algorithm_name(run_name),
-            ),
-            "r",
-        ) as f:
-            relationship = find(
-                json.load(f)["relationships"], "source", variable_name
-            )
+        return load_index(DATAKIT_PATH)
     except FileNotFoundError:
-        # No relationships to execute, return
-        return
+        return {"algorithms": {}}
 
-    if relationship is None:
-        # No relationship for specified variable found, return
-        return
 
-    # Apply relationship rules
-    for rule in relationship["rules"]:
-        if rule["type"] == "change":
-            # Currently the only type of "change" rule we have is one that
-            # mirrors the schema from the source to other resources, so assume
-            # this is the case here
+def get_completion_algorithm(ctx: typer.Context) -> Optional[str]:
+    """Return the algorithm of the run selected on the command line"""
+    run_name = ctx.params.get("run_name") or get_active_run_name(DATAKIT_PATH)
 
-            # TODO: This will need to change in the future
+    # Run names are in the format [algorithm].[run name]
+    return run_name.split(".")[0] if run_name else None
 
-            source = load_resource_by_variable(
-                run_name=run_name,
-                variable_name=variable_name,
-                base_path=DATAKIT_PATH,
-                as_dict=True,
-            )
 
-            for target in rule["targets"]:
-                update_resource(
-                    run_name=run_name,
-                    resource_name=target["name"],
-                    schema=source["schema"],
-                    base_path=DATAKIT_PATH,
-                )
+def complete_run(incomplete: str) -> List[str]:
+    """Complete run names from the run directories"""
+    return [
+        run_name[: -len(RUN_EXTENSION)]
+        for run_name in get_run_names(DATAKIT_PATH)
+        if run_name.startswith(incomplete)
+    ]
 
-        elif rule["type"] == "value":
-            # Check if this rule applies to current run configuration state
-
-            # Get source variable value
-            value = load_variable(
-                run_name=run_name,
-                variable_name=variable_name,
-                base_path=DATAKIT_PATH,
-            )["value"]
-
-            # If the source variable value matches the rule value, execute
-            # the relationship
-            if value in rule["values"]:
-                for target in rule["targets"]:
-                    if "disabled" in target:
-                        # Set target variable disabled value
-                        target_variable = load_variable(
-                            run_name=run_name,
-                            variable_name=target["name"],
-                            base_path=DATAKIT_PATH,
-                        )
 
-                        target_variable["disabled"] = target["disabled"]
+def complete_variable(ctx: typer.Context, incomplete: str) -> List[str]:
+    """Complete variable names of the selected run from the datakit index"""
+    algorithms = load_completion_index()["algorithms"]
+    algorithm = algorithms.get(get_completion_algorithm(ctx))
 
-                    if target["type"] == "resource":
-                        # Set target resource data and schema
-                        target_resource = load_resource_by_variable(
-                            run_name=run["name"],
-                            variable_name=target["name"],
-                            base_path=DATAKIT_PATH,
-                            as_dict=True,
-                        )
+    return [
+        variable_name
+        for variable_name in (algorithm or {}).get("variables", [])
+        if variable_name.startswith(incomplete)
+    ]
 
-                        if "data" in target:
-                            print(
-                                " [bold]*[/bold] Setting "
-                                f"{target_resource['name']} data"
-                            )
-                            target_resource["data"] = target["data"]
-
-                        if "schema" in target:
-                            print(
-                                " [bold]*[/bold] Setting "
-                                f"{target_resource['name']} schema"
-                            )
-                            target_resource["schema"] = target["schema"]
-
-                        write_resource(
-                            run_name=run["name"],
-                            resource=target_resource,
-                            base_path=DATAKIT_PATH,
-                        )
-                    elif target["type"] == "value":
-                        # Set target variable value
-                        target_variable = find_by_name(
-                            run["data"]["inputs"] + run["data"]["outputs"],
-                            target["name"],
-                        )
 
-                        if "value" in target:
-                            print(
-                                f" [bold]*[/bold] Setting {target['name']} "
-                                f"value from {target_variable['value']} to "
-                                f"{target['value']}"
-                            )
-                            target_variable["value"] = target["value"]
-
-                        if "metaschema" in target:
-                            print(
-                                f" [bold]*[/bold] Setting {target['name']} "
-                                "metaschema from "
-                                f"{target_variable['metaschema']} "
-                                f"to {target['metaschema']}"
-                            )
-                            target_variable["metaschema"] = target[
-                                "metaschema"
-                            ]
-                    else:
-                        raise NotImplementedError(
-                            (
-                                'Only "resource" and "value" type rule '
-                                "targets are implemented"
-                            )
-                        )
+def complete_view(ctx: typer.Context, incomplete: str) -> List[str]:
+    """Complete view names of the selected run from the datakit index"""
+    algorithms = load_completion_index()["algorithms"]
+    algorithm = algorithms.get(get_completion_algorithm(ctx))
+
+    return [
+        view_name
+        for view_name in (algorithm or {}).get("views", [])
+        if view_name.startswith(incomplete)
+    ]
 
-        else:
-            raise NotImplementedError("Only value-based rules are implemented")
 
-    # Write modified run configuration
-    write_run_configuration(run, base_path=DATAKIT_PATH)
+# Run selection option shared by commands that operate on a single run
+RunOption = Annotated[
+    Optional[str],
+    typer.Option(
+        "--run",
+        help="Run to use in the format [algorithm].[run name] (defaults to "
+        "the active run)",
+        show_default=False,
+        autocompletion=complete_run,
+    ),
+]
 
 
 # Commands
 
 
 @app.command()
+@handle_errors
 def init(
     run_name: Annotated[
         Optional[str],
@@ -302,140 +252,81 @@ def init(
             )
         ),
     ] = None,
+    manifest: Annotated[
+        Optional[str],
+        typer.Option(
+            "--from",
+            help=(
+                "YAML manifest of runs to initialise, each with optional "
+                "input values"
+            ),
+            show_default=False,
+        ),
+    ] = None,
+    max_workers: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Maximum number of resources to initialise concurrently"
+        ),
+    ] = None,
 ) -> None:
-    """Initialise a datakit run"""
-    run_name = get_full_run_name(run_name)
-
-    # Check directory doesn't already exist
-    if run_exists(run_name):
-        print(f"[red]{run_name} already exists[/red]")
-        exit(1)
+    """Initialise a datakit run
 
-    # Create run directory
-    run_dir = RUN_DIR.format(base_path=DATAKIT_PATH, run_name=run_name)
-    os.makedirs(f"{run_dir}/resources")
-    os.makedirs(f"{run_dir}/views")
-    print(f"[bold]=>[/bold] Created run directory: {run_dir}")
-
-    algorithm_name = get_algorithm_name(run_name)
-    algorithm = load_algorithm(algorithm_name, base_path=DATAKIT_PATH)
-
-    # Generate default run configuration
-    run = {
-        "name": run_name,
-        "title": f"Run configuration for {algorithm_name}",
-        "profile": "datakit-run",
-        "algorithm": f"{algorithm_name}",
-        "container": f'{algorithm["container"]}',
-        "data": {
-            "inputs": [],
-            "outputs": [],
-        },
-    }
-
-    # Create run configuration and initialise resources
-    for variable in algorithm["signature"]["inputs"]:
-        # Add variable defaults to run configuration
-        run["data"]["inputs"].append(
-            {
-                "name": variable["name"],
-                **variable["default"],
-            }
-        )
-
-        # Initialise associated resources
-        if variable["type"] == "resource":
-            resource_name = variable["default"]["resource"]
-
-            init_resource(
-                run_name=run["name"],
-                resource_name=resource_name,
-                base_path=DATAKIT_PATH,
-            )
-
-            print(f"[bold]=>[/bold] Generated input resource: {resource_name}")
-
-    for variable in algorithm["signature"]["outputs"]:
-        # Add variable defaults to run configuration
-        run["data"]["outputs"].append(
-            {
-                "name": variable["name"],
-                **variable["default"],
-            }
-        )
-
-        # Initialise associated resources
-        if variable["type"] == "resource":
-            resource_name = variable["default"]["resource"]
-
-            init_resource(
-                run_name=run["name"],
-                resource_name=resource_name,
-                base_path=DATAKIT_PATH,
-            )
+    With --from, initialise every run listed in a manifest instead, e.g.
+    runs: [{run: fit.a, inputs: {x: 1, data: data.csv}}]. Resource inputs
+    are lists of rows or CSV paths, which are relative to the manifest. If
+    any run fails to initialise, none are created. The active run is
+    unchanged
+    """
+    dk = get_datakit()
 
-            print(f"[bold]=>[/bold] Generated input resource: {resource_name}")
+    if manifest is None:
+        dk.init(run_name)
+        return
 
-    # Write generated configuration
-    write_run_configuration(run, base_path=DATAKIT_PATH)
+    if run_name is not None:
+        print("[red]Specify either a run name or --from, not both[/red]")
+        exit(1)
 
-    print(f"[bold]=>[/bold] Generated default run configuration: {run_name}")
+    runs = load_manifest(manifest, dk)
 
-    # Add default run to datakit.json
-    datakit = load_datakit_configuration(base_path=DATAKIT_PATH)
-    datakit["runs"].append(run_name)
-    write_datakit_configuration(datakit, base_path=DATAKIT_PATH)
+    dk.init_runs(runs, max_workers=max_workers)
 
-    # Write current run name to config
-    write_config(run_name)
+    print(f"[bold]=>[/bold] Initialised {len(runs)} run(s)")
 
 
 @app.command()
+@handle_errors
 def set_run(
     run_name: Annotated[
         Optional[str],
-        typer.Argument(help="Name of the run you want to enable"),
+        typer.Argument(
+            help="Name of the run you want to enable",
+            autocompletion=complete_run,
+        ),
     ] = None,
 ) -> None:
     """Set the active run"""
-    run_name = get_full_run_name(run_name)
-
-    if run_exists(run_name):
-        # Set to active run
-        write_config(run_name)
-    else:
-        print(f"[red]{run_name} does not exist[/red]")
+    get_datakit().set_active_run(run_name)
 
 
 @app.command()
+@handle_errors
 def get_run() -> None:
     """Get the active run"""
-    print(f"[bold]{get_active_run()}[/bold]")
+    print(f"[bold]{get_datakit().get_run().name}[/bold]")
 
 
 @app.command()
-def run() -> None:
+@handle_errors
+def run(run_name: RunOption = None) -> None:
     """Execute the active run"""
-    run_name = get_active_run()
+    run = get_datakit().get_run(run_name)
 
     # Execute algorithm container and print any logs
-    print(f"[bold]=>[/bold] Executing [bold]{run_name}[/bold]")
+    print(f"[bold]=>[/bold] Executing [bold]{run.name}[/bold]")
 
-    try:
-        logs = execute_datakit(
-            client,
-            run_name,
-            base_path=DATAKIT_PATH,
-        )
-    except ExecutionError as e:
-        print(
-            Panel(
-                e.logs,
-                title="[bold red]Execution error[/bold red]",
-            )
-        )
-        print("[red]Container execution failed[/red]")
-        exit(1)
+    logs = run.execute()
 
     if logs:
         print(
@@ -445,94 +336,230 @@ def run() -> None:
             )
         )
 
-    print(f"[bold]=>[/bold] Executed [bold]{run_name}[/bold] successfully")
+    print(f"[bold]=>[/bold] Executed [bold]{run.name}[/bold] successfully")
 
 
 @app.command()
+@handle_errors
 def show(
     variable_name: Annotated[
         str,
         typer.Argument(
             help="Name of variable to print",
             show_default=False,
+            autocompletion=complete_variable,
         ),
     ],
+    run_name: RunOption = None,
 ) -> None:
     """Print a variable value"""
-    run_name = get_active_run()
+    print_variable(get_datakit().get_run(run_name), variable_name)
 
-    # Load algorithum signature to check variable type
-    signature = load_variable_signature(
-        run_name=run_name,
-        variable_name=variable_name,
-        base_path=DATAKIT_PATH,
-    )
 
-    if signature["type"] == "resource":
-        # Variable is a tabular data resource
-        resource = load_resource_by_variable(
-            run_name=run_name,
-            variable_name=variable_name,
-            base_path=DATAKIT_PATH,
-        )
+@app.command()
+@handle_errors
+def export(
+    variable_names: Annotated[
+        List[str],
+        typer.Argument(
+            help="Names of the variables to export",
+            show_default=False,
+            autocompletion=complete_variable,
+        ),
+    ],
+    output: Annotated[
+        str,
+        typer.Option(
+            "--output",
+            "-o",
+            help="Path to write to, as Parquet (.parquet) or CSV (.csv)",
+            show_default=False,
+        ),
+    ],
+    run_names: Annotated[
+        Optional[List[str]],
+        typer.Option(
+            "--run",
+            help=(
+                "Run to export, may be repeated (defaults to all runs of the "
+                "active run's algorithm)"
+            ),
+            show_default=False,
+            autocompletion=complete_run,
+        ),
+    ] = None,
+    max_workers: Annotated[
+        Optional[int],
+        typer.Option(help="Maximum number of runs to read concurrently"),
+    ] = None,
+) -> None:
+    """Export variable values from many runs into a single table
 
-        print(
-            tabulate(
-                resource.to_dict()["data"],
-                headers="keys",
-                tablefmt="rounded_grid",
+    Each row is labelled with the run it came from. Table columns are named
+    [variable name].[column name]
+    """
+    output_format = os.path.splitext(output)[1]
+
+    if output_format not in [".parquet", ".csv"]:
+        print(f"[red]Unsupported export format: {output_format}[/red]")
+        exit(1)
+
+    dk = get_datakit()
+
+    if run_names:
+        runs = [dk.get_run(run_name) for run_name in run_names]
+    else:
+        algorithm = dk.get_run().algorithm
+        runs = [run for run in dk.runs if run.algorithm == algorithm]
+
+    print(f"[bold]=>[/bold] Reading {len(runs)} run(s)")
+
+    frame = dk.export(variable_names, runs=runs, max_workers=max_workers)
+
+    if output_format == ".parquet":
+        try:
+            import pyarrow
+        except ImportError:
+            print(
+                "[red]Exporting Parquet requires pyarrow, install it with "
+                'pip install "datakitcli\\[parquet]"[/red]'
             )
-        )
+            exit(1)
+
+        try:
+            frame.to_parquet(output, index=False)
+        except (pyarrow.ArrowTypeError, pyarrow.ArrowInvalid) as e:
+            # Find the column pyarrow couldn't convert, e.g. one mixing
+            # numbers and strings across runs
+            for column in frame.columns:
+                try:
+                    pyarrow.array(frame[column], from_pandas=True)
+                except (
+                    pyarrow.ArrowTypeError,
+                    pyarrow.ArrowInvalid,
+                ) as column_error:
+                    print(
+                        f"[red]Could not export column {column} to Parquet: "
+                        f"{escape(str(column_error))}[/red]"
+                    )
+                    break
+            else:
+                print(
+                    "[red]Could not export to Parquet: "
+                    f"{escape(str(e))}[/red]"
+                )
+            print("[red]Try exporting to CSV instead[/red]")
+            exit(1)
     else:
-        # Variable is a simple string/number/bool value
-        variable = load_variable(
-            run_name=run_name,
-            variable_name=variable_name,
-            base_path=DATAKIT_PATH,
-        )
+        frame.to_csv(output, index=False)
+
+    print(
+        f"[bold]=>[/bold] Exported {len(frame)} row(s) from {len(runs)} "
+        f"run(s) to [bold]{output}[/bold]"
+    )
+
+
+@app.command()
+@handle_errors
+def compare(
+    run_a: Annotated[
+        str,
+        typer.Argument(
+            help="First run in the format [algorithm].[run name]",
+            show_default=False,
+            autocompletion=complete_run,
+        ),
+    ],
+    run_b: Annotated[
+        str,
+        typer.Argument(
+            help="Second run in the format [algorithm].[run name]",
+            show_default=False,
+            autocompletion=complete_run,
+        ),
+    ],
+    variable_names: Annotated[
+        Optional[List[str]],
+        typer.Option(
+            "--variable",
+            help="Variable to compare, may be repeated (defaults to all)",
+            show_default=False,
+        ),
+    ] = None,
+    rtol: Annotated[
+        float,
+        typer.Option(help="Relative tolerance for comparing numbers"),
+    ] = 1e-05,
+    atol: Annotated[
+        float,
+        typer.Option(help="Absolute tolerance for comparing numbers"),
+    ] = 1e-08,
+    max_rows: Annotated[
+        int,
+        typer.Option(help="Maximum number of differences to print"),
+    ] = 20,
+) -> None:
+    """Print the variable values that differ between two runs"""
+    dk = get_datakit()
+    a, b = dk.get_run(run_a), dk.get_run(run_b)
+
+    diff = a.compare(b, variable_names or None, rtol=rtol, atol=atol)
+
+    if diff.empty:
+        print(f"[bold]=>[/bold] No differences between {a.name} and {b.name}")
+        return
 
+    for variable_name, count in (
+        diff["variable"].value_counts(sort=False).items()
+    ):
         print(
-            Panel(
-                str(variable["value"]),
-                title=f"{variable_name}",
-                expand=False,
-            )
+            f"[bold]=>[/bold] [bold]{variable_name}[/bold] differs in "
+            f"{count} value(s)"
         )
 
+    print(
+        tabulate(
+            diff.head(max_rows),
+            headers=["variable", "row", "column", a.name, b.name],
+            tablefmt="rounded_grid",
+            showindex=False,
+        )
+    )
+
+    if len(diff) > max_rows:
+        print(f"... and {len(diff) - max_rows} more difference(s)")
+
 
 @app.command()
+@handle_errors
 def view(
     view_name: Annotated[
         str,
         typer.Argument(
-            help="The name of the view to render", show_default=False
+            help="The name of the view to render",
+            show_default=False,
+            autocompletion=complete_view,
         ),
     ],
+    decimate: Annotated[
+        bool,
+        typer.Option(
+            help=(
+                "Downsample large line and scatter plots to screen "
+                "resolution, re-fetching full resolution data on zoom"
+            ),
+        ),
+    ] = False,
+    run_name: RunOption = None,
 ) -> None:
     """Render a view locally"""
-    run_name = get_active_run()
+    from cli.api import format_size
+
+    run = get_datakit().get_run(run_name)
 
     print(f"[bold]=>[/bold] Generating [bold]{view_name}[/bold] view")
 
-    try:
-        logs = execute_view(
-            docker_client=client,
-            run_name=run_name,
-            view_name=view_name,
-            base_path=DATAKIT_PATH,
-        )
-    except ResourceError as e:
-        print("[red]" + e.message + "[/red]")
-        exit(1)
-    except ExecutionError as e:
-        print(
-            Panel(
-                e.logs,
-                title="[bold red]View execution error[/bold red]",
-            )
-        )
-        print("[red]View execution failed[/red]")
-        exit(1)
+    logs = run.view(view_name)
 
     if logs:
         print(
@@ -550,30 +577,117 @@ def view(
         "[blue][bold]=>[/bold] Loading interactive view in web browser[/blue]"
     )
 
+    # Imported here as matplotlib is slow to import and only needed to
+    # render views
+    import matplotlib
+    import matplotlib.pyplot as plt
+    from cli.decimate import FigureDecimator
+
     matplotlib.use("WebAgg")
 
-    with open(
-        VIEW_ARTEFACTS_DIR.format(base_path=DATAKIT_PATH, run_name=run_name)
-        + f"/{view_name}.p",
-        "rb",
-    ) as f:
-        # NOTE: The matplotlib version in CLI must be >= the version of
-        # matplotlib used to generate the plot (which is chosen by the user)
-        # So the CLI should be kept up to date at all times
+    start_time = time.perf_counter()
+
+    # Load matplotlib figure
+    figure = run.load_view(view_name)
+
+    load_time = time.perf_counter() - start_time
+
+    # Decimate large artists, keeping the full data for zooming
+    decimator = FigureDecimator(
+        figure,
+        min_points=2 * int(figure.get_figwidth() * figure.dpi),
+    )
+    total_points = decimator.attach() if decimate else None
+
+    artefact_size = os.path.getsize(run.get_view_artefact_path(view_name))
 
-        # Load matplotlib figure
-        pickle.load(f)
+    print(
+        f"[bold]=>[/bold] Loaded [bold]{view_name}[/bold] view artefact "
+        f"({format_size(artefact_size)}) in {load_time:.2f}s"
+    )
+
+    if decimate:
+        print(
+            f"[bold]=>[/bold] Decimated {len(decimator.lines)} line(s) and "
+            f"{len(decimator.collections)} scatter plot(s) of "
+            f"{total_points} total points"
+        )
 
     plt.show()
 
 
 @app.command()
+@handle_errors
+def watch(
+    view_names: Annotated[
+        Optional[List[str]],
+        typer.Option(
+            "--view",
+            help=(
+                "View to re-render after each execution (defaults to all "
+                "views)"
+            ),
+            show_default=False,
+            autocompletion=complete_view,
+        ),
+    ] = None,
+    debounce: Annotated[
+        float,
+        typer.Option(
+            help="Seconds to wait for changes to stop before re-executing"
+        ),
+    ] = 0.5,
+    run_name: RunOption = None,
+) -> None:
+    """Re-execute a run whenever its inputs or algorithm change
+
+    Relationships are applied to changed inputs, the run is executed and
+    views are re-rendered. An execution in progress is cancelled when a newer
+    change arrives
+    """
+    from watchdog.observers import Observer
+    from cli.watch import RunWatcher
+
+    dk = get_datakit()
+    run = dk.get_run(run_name)
+
+    if not view_names:
+        view_names = dk.load_index()["algorithms"][run.algorithm]["views"]
+
+    watcher = RunWatcher(run, view_names, debounce, on_error=print_error)
+
+    observer = Observer()
+    observer.schedule(watcher, run.path, recursive=True)
+    observer.schedule(watcher, f"{dk.path}/{run.algorithm}", recursive=True)
+    observer.start()
+
+    print(
+        f"[blue][bold]=>[/bold] Watching [bold]{run.name}[/bold] for "
+        "changes, press Ctrl+C to stop[/blue]"
+    )
+
+    watcher.start()
+
+    try:
+        while True:
+            watcher.wait_for_changes()
+            watcher.handle_changes()
+    except KeyboardInterrupt:
+        watcher.cancel()
+    finally:
+        observer.stop()
+        observer.join()
+
+
+@app.command()
+@handle_errors
 def load(
     variable_name: Annotated[
         str,
         typer.Argument(
             help="Name of variable to populate",
             show_default=False,
+            autocompletion=complete_variable,
         ),
     ],
     path: Annotated[
@@ -582,36 +696,16 @@ def load(
             help="Path to data to ingest (xml, csv)", show_default=False
         ),
     ],
+    run_name: RunOption = None,
 ) -> None:
     """Load data into configuration variable"""
-    run_name = get_active_run()
-
-    # Load resource into TabularDataResource object
-    resource = load_resource_by_variable(
-        run_name=run_name,
-        variable_name=variable_name,
-        base_path=DATAKIT_PATH,
-    )
-
-    # Read CSV into resource
-    print(f"[bold]=>[/bold] Reading {path}")
-    resource.data = pd.read_csv(path)
-
-    # Write to resource
-    write_resource(
-        run_name=run_name, resource=resource, base_path=DATAKIT_PATH
-    )
-
-    # Execute any applicable relationships
-    execute_relationship(
-        run_name=run_name,
-        variable_name=variable_name,
-    )
+    get_datakit().get_run(run_name).load(variable_name, path)
 
     print("[bold]=>[/bold] Resource successfully loaded!")
 
 
 @app.command()
+@handle_errors
 def set(
     variable_ref: Annotated[
         str,
@@ -621,6 +715,7 @@ def set(
                 "[resource name].[primary key].[column name]"
             ),
             show_default=False,
+            autocompletion=complete_variable,
         ),
     ],
     variable_value: Annotated[
@@ -631,179 +726,74 @@ def set(
             show_default=False,
         ),
     ],
+    run_name: RunOption = None,
 ) -> None:
     """Set a variable value"""
-    run_name = get_active_run()
+    run = get_datakit().get_run(run_name)
 
     # Parse value (workaround for Typer not supporting Union types :<)
-    variable_value = dumb_str_to_type(variable_value)
-
-    if "." in variable_ref:
-        # Variable reference is a table reference
-
-        # Check the variable_ref matches the pattern:
-        # [resource].[primary key].[column]
-        pattern = re.compile(
-            r"^([a-zA-Z0-9_]+)\.([a-zA-Z0-9_]+)\.([a-zA-Z0-9_]+)$"
-        )
-
-        if not pattern.match(variable_ref):
-            print(
-                "[red]Variable name argument must be either a variable name "
-                "or a table reference in the format "
-                r"\[resource name].\[primary key].\[column name][/red]"
-            )
-            exit(1)
-
-        # Parse variable and row/col names
-        variable_name, row_name, col_name = variable_ref.split(".")
-
-        # Load param resource
-        resource = load_resource_by_variable(
-            run_name=run_name,
-            variable_name=variable_name,
-            base_path=DATAKIT_PATH,
-        )
-
-        # Check it's a tabular data resource
-        if resource.profile != "tabular-data-resource":
-            print(
-                f"[red]Resource [bold]{resource.name}[/bold] is not of type "
-                '"tabular-data-resource"[/red]'
-            )
-            exit(1)
+    variable_name = run.set(variable_ref, dumb_str_to_type(variable_value))
 
-        # If data is not populated, something has gone wrong
-        if not resource:
-            print(
-                f'[red]Parameter resource [bold]{resource.name}[/bold] "data" '
-                'field is empty. Try running "dk reset"?[/red]'
-            )
-            exit(1)
+    print_variable(run, variable_name)
 
-        print(
-            f"[bold]=>[/bold] Setting table value at row [bold]{row_name}"
-            f"[/bold] and column [bold]{col_name}[/bold] to "
-            f"[bold]{variable_value}[/bold]"
-        )
-
-        # Set table value
-        try:
-            # This will generate a key error if row_name doesn't exist
-            # The assignment doesn't unfortunately
-            resource.data.loc[row_name]  # Ensure row exists
-            resource.data.loc[row_name, col_name] = variable_value
-        except KeyError:
-            print(
-                f'[red]Could not find row "{row_name}" or column "{col_name}" '
-                f"in resource [bold]{resource.name}[/bold][/red]"
-            )
-            exit(1)
 
-        # Write resource
-        write_resource(
-            run_name=run_name, resource=resource, base_path=DATAKIT_PATH
-        )
+@app.command()
+def reset():
+    """Reset datakit to clean state
 
-        print(
-            f"[bold]=>[/bold] Successfully set table value at row "
-            f"[bold]{row_name}[/bold] and column [bold]{col_name}[/bold] to "
-            f"[bold]{variable_value}[/bold] in resource [bold]{resource.name}"
-            "[/bold]"
-        )
-    else:
-        # Variable reference is a simple variable name
-        variable_name = variable_ref
+    Removes all run outputs and resets configurations to default
+    """
+    get_datakit().reset()
 
-        # Load variable signature
-        signature = load_variable_signature(
-            run_name, variable_name, base_path=DATAKIT_PATH
-        )
 
-        # Convenience dict mapping datakit types to Python types
-        type_map = {
-            "string": [str],
-            "boolean": [bool],
-            "number": [float, int],
-        }
-
-        # Check the value is of the expected type for this variable
-        # Raise some helpful errors
-        if signature.get("profile") == "tabular-data-resource":
-            print('[red]Use command "load" for tabular data resource[/red]')
-            exit(1)
-        elif "parameter-tabular-data-resource" in signature.get("profile", ""):
-            print('[red]Use command "set-param" for parameter resource[/red]')
-            exit(1)
-        # Specify False as fallback value here to avoid "None"s leaking through
-        elif not (type(variable_value) in type_map.get(signature["type"], [])):
-            print(
-                f"[red]Variable value must be of type {signature['type']}"
-                "[/red]"
+@app.command()
+def gc(
+    keep_last: Annotated[
+        Optional[int],
+        typer.Option(help="Keep only the N most recent runs per algorithm"),
+    ] = None,
+    max_age: Annotated[
+        Optional[float],
+        typer.Option(help="Delete runs not modified in this many days"),
+    ] = None,
+    max_size: Annotated[
+        Optional[float],
+        typer.Option(
+            help=(
+                "Delete the oldest runs until the total run size is under "
+                "this many megabytes"
             )
-            exit(1)
-
-        # If this variable has an enum, check the value is allowed
-        if signature.get("enum", False):
-            allowed_values = [i["value"] for i in signature["enum"]]
-            if variable_value not in allowed_values:
-                print(
-                    f"[red]Variable value must be one of {allowed_values}"
-                    "[/red]"
-                )
-                exit(1)
-
-        # Check if nullable
-        if not signature["null"]:
-            if not variable_value:
-                print("[red]Variable value cannot be null[/red]")
-                exit(1)
-
-        # Load run configuration
-        run = load_run_configuration(run_name, base_path=DATAKIT_PATH)
-
-        # Set variable value
-        find_by_name(
-            run["data"]["inputs"] + run["data"]["outputs"], variable_name
-        )["value"] = variable_value
+        ),
+    ] = None,
+    dry_run: Annotated[
+        bool,
+        typer.Option(help="List runs that would be deleted without deleting"),
+    ] = False,
+) -> None:
+    """Delete old runs and unused stored files
 
-        # Write configuration
-        write_run_configuration(run, base_path=DATAKIT_PATH)
+    The active run is never deleted
+    """
+    from cli.api import format_size
 
-        # Execute any relationships applied to this variable value
-        execute_relationship(
-            run_name=run_name,
-            variable_name=variable_name,
-        )
+    result = get_datakit().gc(
+        keep_last=keep_last,
+        max_age=max_age,
+        max_size=max_size,
+        dry_run=dry_run,
+    )
 
+    if dry_run:
         print(
-            f"[bold]=>[/bold] Successfully set [bold]{variable_name}[/bold] "
-            "variable"
+            f"[bold]=>[/bold] Would delete {len(result['deleted'])} run(s) "
+            f"({format_size(sum(result['deleted'].values()))})"
         )
+        return
 
-    show(variable_name)
-
-
-@app.command()
-def reset():
-    """Reset datakit to clean state
-
-    Removes all run outputs and resets configurations to default
-    """
-    # Remove all run directories
-    for f in os.scandir(DATAKIT_PATH):
-        if f.is_dir() and f.path.endswith(".run"):
-            print(f"[bold]=>[/bold] Deleting [bold]{f.name}[/bold]")
-            shutil.rmtree(f.path)
-
-    # Remove all run references from datakit.json
-    datakit = load_datakit_configuration(base_path=DATAKIT_PATH)
-    datakit["runs"] = []
-    write_datakit_configuration(datakit, base_path=DATAKIT_PATH)
-
-    # Remove CLI config
-    if os.path.exists(CONFIG_FILE):
-        os.remove(CONFIG_FILE)
+    print(
+        f"[bold]=>[/bold] Deleted {len(result['deleted'])} run(s) and "
+        f"{format_size(result['freed'])} of unused stored files"
+    )
 
 
 @app.command()
@@ -817,6 +807,8 @@ def new(
     ],
 ) -> None:
     """Generate a new datakit and algorithm scaffold"""
+    from datakitpy.datakit import write_datakit_configuration, write_algorithm
+
     # Create new datakit directory
     datakit_name = f"{algorithm_name}-datakit"
     datakit_dir = f"{DATAKIT_PATH}/{datakit_name}"
@@ -886,5 +878,161 @@ def new(
     print(f"[bold]=>[/bold] Successfully created [bold]{datakit_name}[/bold]")
 
 
+@pipeline_app.command("run")
+@handle_errors
+def pipeline_run(
+    max_workers: Annotated[
+        Optional[int],
+        typer.Option(help="Maximum number of runs to execute concurrently"),
+    ] = None,
+    force: Annotated[
+        bool,
+        typer.Option(
+            help="Execute all runs, even if their inputs are unchanged"
+        ),
+    ] = False,
+) -> None:
+    """Execute the pipeline defined in pipeline.json
+
+    Each stage names a run and maps its inputs to upstream outputs, e.g.
+    {"run": "fit.main", "inputs": {"data": "clean.main.result"}}
+
+    Independent runs are executed concurrently, and runs whose inputs and
+    algorithm are unchanged since their last execution are skipped
+    """
+    import docker
+    from cli.api import Run, RunExecutionError
+    from cli.pipeline import (
+        load_pipeline,
+        load_pipeline_state,
+        get_run_fingerprint,
+        get_output_fingerprint,
+        link_pipeline_inputs,
+        PIPELINE_STATE_FILE,
+    )
+
+    dk = get_datakit()
+    pipeline = load_pipeline(dk)
+
+    # Initialise any runs that don't exist yet
+    dk.init_runs(
+        {
+            run_name[: -len(RUN_EXTENSION)]: {}
+            for run_name in pipeline
+            if not dk.run_exists(run_name)
+        }
+    )
+
+    def execute_stage(run_name: str) -> Optional[dict]:
+        """Link inputs and execute a single run
+
+        Returns the pipeline state of the executed run, or None if skipped
+        """
+        run = Run(dk, run_name)
+
+        # Other dk processes may be modifying this run
+        with run.lock():
+            link_pipeline_inputs(run, pipeline[run_name])
+
+            # Skip runs whose inputs are unchanged, unless their outputs have
+            # changed since (e.g. the run was executed outside the pipeline)
+            state = load_pipeline_state(run)
+            fingerprint = get_run_fingerprint(run)
+            if (
+                not force
+                and state.get("inputs") == fingerprint
+                and state.get("outputs") == get_output_fingerprint(run)
+            ):
+                print(
+                    "[bold]=>[/bold] Skipping unchanged "
+                    f"[bold]{run_name}[/bold]"
+                )
+                run.store()
+                return None
+
+            print(f"[bold]=>[/bold] Executing [bold]{run_name}[/bold]")
+
+            # Docker clients aren't safe to share between threads
+            logs = run.execute(docker.from_env())
+
+            if logs:
+                print(
+                    Panel(
+                        logs,
+                        title=f"[bold]{run_name} container output[/bold]",
+                    )
+                )
+
+            state = {
+                "inputs": fingerprint,
+                "outputs": get_output_fingerprint(run),
+            }
+
+        print(f"[bold]=>[/bold] Executed [bold]{run_name}[/bold] successfully")
+
+        return state
+
+    pending = dict(pipeline)
+    running = {}  # Future -> run name
+    completed, failed = [], []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Submit every stage whose upstream runs have all completed
+            for run_name, links in list(pending.items()):
+                sources = [source_run for _, source_run, _ in links]
+
+                if any(source in failed for source in sources):
+                    print(
+                        f"[red]Skipping {run_name} as an upstream run "
+                        "failed[/red]"
+                    )
+                    failed.append(run_name)
+                    del pending[run_name]
+                elif all(source in completed for source in sources):
+                    future = executor.submit(execute_stage, run_name)
+                    running[future] = run_name
+                    del pending[run_name]
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                run_name = running.pop(future)
+
+                try:
+                    state = future.result()
+                except RunExecutionError as e:
+                    print(
+                        Panel(
+                            escape(e.logs),
+                            title=(
+                                f"[bold red]{run_name} execution error"
+                                "[/bold red]"
+                            ),
+                        )
+                    )
+                    failed.append(run_name)
+                else:
+                    completed.append(run_name)
+
+                    # Record progress so completed runs are skipped next time
+                    if state is not None:
+                        write_json(
+                            PIPELINE_STATE_FILE.format(
+                                run_dir=Run(dk, run_name).path
+                            ),
+                            state,
+                        )
+
+    if failed:
+        print(f"[red]Pipeline failed: {', '.join(failed)}[/red]")
+        exit(1)
+
+    print("[bold]=>[/bold] Pipeline executed successfully")
+
+
 if __name__ == "__main__":
     app()
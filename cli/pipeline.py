@@ -0,0 +1,261 @@
+import os
+import json
+import hashlib
+from rich import print
+from datakitpy.datakit import (
+    get_algorithm_name,
+    load_resource_by_variable,
+    write_resource,
+    write_run_configuration,
+    load_variable,
+)
+from datakitpy.helpers import find_by_name
+from cli.api import Datakit, Run, PipelineError, VariableError
+
+PIPELINE_FILE = "{base_path}/pipeline.json"
+PIPELINE_STATE_FILE = "{run_dir}/.pipeline"  # Last pipeline execution
+
+
+def load_pipeline(datakit: Datakit) -> dict:
+    """Load the pipeline definition of a datakit as a graph of runs
+
+    Both ends of every link are checked against the algorithm signatures, so
+    mistakes are reported before any run is executed.
+
+    Returns a dict of run name to a list of (input variable name, source run
+    name, source variable name) links
+    """
+    pipeline_file = PIPELINE_FILE.format(base_path=datakit.path)
+
+    try:
+        with open(pipeline_file, "r") as f:
+            stages = json.load(f)["stages"]
+    except FileNotFoundError:
+        raise PipelineError(f"No pipeline definition found at {pipeline_file}")
+    except (json.JSONDecodeError, KeyError, TypeError):
+        stages = None
+
+    if not isinstance(stages, list):
+        raise PipelineError(f'{pipeline_file} must contain a list of "stages"')
+
+    pipeline = {}
+
+    for stage in stages:
+        if (
+            not isinstance(stage, dict)
+            or not isinstance(stage.get("run"), str)
+            or not isinstance(stage.get("inputs", {}), dict)
+        ):
+            raise PipelineError(
+                'Pipeline stages must have a "run" name and optional '
+                f'"inputs": {stage}'
+            )
+
+        run_name = datakit.get_full_run_name(stage["run"])
+        pipeline[run_name] = []
+
+        for variable_name, source in stage.get("inputs", {}).items():
+            # Sources are in the format [run name].[variable name]
+            if not isinstance(source, str) or "." not in source:
+                raise PipelineError(
+                    f"Input {variable_name} of {run_name} must be in the "
+                    f"format [run name].[variable name], not {source}"
+                )
+
+            source_run, source_variable = source.rsplit(".", 1)
+            pipeline[run_name].append(
+                (
+                    variable_name,
+                    datakit.get_full_run_name(source_run),
+                    source_variable,
+                )
+            )
+
+    # Validate links
+    for run_name, links in pipeline.items():
+        algorithm = datakit.load_index()["algorithms"][
+            get_algorithm_name(run_name)
+        ]
+
+        for variable_name, source_run, source_variable in links:
+            if source_run not in pipeline:
+                raise PipelineError(
+                    f"{run_name} depends on {source_run}, which is not a "
+                    "pipeline stage"
+                )
+
+            # Pipelines only write inputs, outputs are left to the algorithm
+            target = find_by_name(
+                algorithm["signature"]["inputs"], variable_name
+            )
+            if target is None:
+                raise PipelineError(
+                    f'{run_name} is linked to "{variable_name}", which is not '
+                    f"an input of {get_algorithm_name(run_name)}"
+                )
+
+            try:
+                source = datakit.get_variable_signature(
+                    source_run, source_variable
+                )
+            except VariableError as e:
+                raise PipelineError(
+                    f"Input {variable_name} of {run_name} is linked to a "
+                    f"missing variable: {e}"
+                )
+
+            if source["type"] != target["type"]:
+                raise PipelineError(
+                    f"Input {variable_name} of {run_name} has type "
+                    f'"{target["type"]}", but is linked to {source_variable} '
+                    f'of {source_run} with type "{source["type"]}"'
+                )
+
+    # Check for cycles by repeatedly removing stages with no dependencies
+    remaining = {
+        run_name: {source_run for _, source_run, _ in links}
+        for run_name, links in pipeline.items()
+    }
+    while remaining:
+        ready = [
+            r for r, deps in remaining.items() if not deps & remaining.keys()
+        ]
+        if not ready:
+            raise PipelineError(
+                f"Pipeline contains a cycle between: {', '.join(remaining)}"
+            )
+        for run_name in ready:
+            del remaining[run_name]
+
+    return pipeline
+
+
+def load_pipeline_state(run: Run) -> dict:
+    """Load the fingerprints of a run's last successful pipeline execution
+
+    State is kept in the run directory, so it's removed along with the run
+    by dk reset and dk gc.
+    """
+    try:
+        with open(PIPELINE_STATE_FILE.format(run_dir=run.path), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def get_run_fingerprint(run: Run) -> str:
+    """Return a hash of everything that affects the outputs of a run
+
+    This covers the input variable values, input resource data and the
+    algorithm code and configuration.
+    """
+    digest = hashlib.sha256()
+
+    inputs = run.configuration["data"]["inputs"]
+    digest.update(json.dumps(inputs, sort_keys=True).encode())
+
+    for variable in inputs:
+        if run.get_signature(variable["name"])["type"] == "resource":
+            resource = load_resource_by_variable(
+                run_name=run.name,
+                variable_name=variable["name"],
+                base_path=run.datakit.path,
+                as_dict=True,
+            )
+            digest.update(json.dumps(resource, sort_keys=True).encode())
+
+    digest.update(get_algorithm_digest(run.datakit, run.algorithm).encode())
+
+    return digest.hexdigest()
+
+
+def get_output_fingerprint(run: Run) -> str:
+    """Return a hash of the output variable values and resource data"""
+    digest = hashlib.sha256()
+
+    outputs = run.configuration["data"]["outputs"]
+    digest.update(json.dumps(outputs, sort_keys=True).encode())
+
+    for variable in outputs:
+        if run.get_signature(variable["name"])["type"] == "resource":
+            resource = load_resource_by_variable(
+                run_name=run.name,
+                variable_name=variable["name"],
+                base_path=run.datakit.path,
+                as_dict=True,
+            )
+            digest.update(json.dumps(resource, sort_keys=True).encode())
+
+    return digest.hexdigest()
+
+
+def get_algorithm_digest(datakit: Datakit, algorithm_name: str) -> str:
+    """Return a hash of the algorithm code and configuration"""
+    digest = hashlib.sha256()
+
+    algorithm_dir = f"{datakit.path}/{algorithm_name}"
+    for root, dirs, files in os.walk(algorithm_dir):
+        dirs.sort()
+        dirs[:] = [d for d in dirs if d != "__pycache__"]
+        for name in sorted(files):
+            digest.update(name.encode())
+            with open(f"{root}/{name}", "rb") as f:
+                digest.update(hashlib.file_digest(f, "sha256").digest())
+
+    return digest.hexdigest()
+
+
+def link_pipeline_inputs(run: Run, links: list) -> None:
+    """Copy upstream output values into the inputs of a pipeline run"""
+    datakit = run.datakit
+
+    run.detach_inputs()
+
+    for variable_name, source_run, source_variable in links:
+        print(
+            f"[bold]=>[/bold] Linking {source_run} {source_variable} to "
+            f"{run.name} {variable_name}"
+        )
+
+        signature = datakit.get_variable_signature(source_run, source_variable)
+
+        if signature["type"] == "resource":
+            with Run(datakit, source_run).lock(shared=True):
+                source_resource = load_resource_by_variable(
+                    run_name=source_run,
+                    variable_name=source_variable,
+                    base_path=datakit.path,
+                    as_dict=True,
+                )
+            target_resource = load_resource_by_variable(
+                run_name=run.name,
+                variable_name=variable_name,
+                base_path=datakit.path,
+                as_dict=True,
+            )
+
+            target_resource["data"] = source_resource["data"]
+            target_resource["schema"] = source_resource["schema"]
+
+            write_resource(
+                run_name=run.name,
+                resource=target_resource,
+                base_path=datakit.path,
+            )
+        else:
+            with Run(datakit, source_run).lock(shared=True):
+                value = load_variable(
+                    run_name=source_run,
+                    variable_name=source_variable,
+                    base_path=datakit.path,
+                )["value"]
+
+            configuration = run.configuration
+            find_by_name(
+                configuration["data"]["inputs"]
+                + configuration["data"]["outputs"],
+                variable_name,
+            )["value"] = value
+            write_run_configuration(configuration, base_path=datakit.path)
+
+        run.execute_relationship(variable_name)
@@ -0,0 +1,292 @@
+import os
+import time
+import json
+import uuid
+import hashlib
+import threading
+import docker
+from typing import Any, Callable, List
+from rich import print
+from rich.panel import Panel
+from watchdog.events import FileSystemEventHandler
+from datakitpy.datakit import load_resource_by_variable
+from cli.api import Run, DatakitError, get_docker_client
+from cli.pipeline import get_algorithm_digest
+
+WATCH_LABEL = "datakit.watch"  # Labels containers started by dk watch
+
+
+def get_watch_snapshot(run: Run) -> dict:
+    """Return a hash of each run input and of the algorithm
+
+    Snapshots are compared to tell changes made to the run inputs apart from
+    the run writing its own outputs.
+    """
+    snapshot = {
+        "inputs": {},
+        "algorithm": get_algorithm_digest(run.datakit, run.algorithm),
+    }
+
+    for variable in run.configuration["data"]["inputs"]:
+        if run.get_signature(variable["name"])["type"] == "resource":
+            value = load_resource_by_variable(
+                run_name=run.name,
+                variable_name=variable["name"],
+                base_path=run.datakit.path,
+                as_dict=True,
+            )
+        else:
+            value = variable
+
+        snapshot["inputs"][variable["name"]] = hashlib.sha256(
+            json.dumps(value, sort_keys=True).encode()
+        ).hexdigest()
+
+    return snapshot
+
+
+def kill_containers(label: str) -> None:
+    """Kill running containers started by the watcher with the given label"""
+    for container in get_docker_client().containers.list(
+        filters={"label": f"{WATCH_LABEL}={label}"}
+    ):
+        try:
+            container.kill()
+        except docker.errors.APIError:
+            # Container already exited
+            pass
+
+
+class LabelledContainers:
+    """Container collection that labels every container it creates"""
+
+    def __init__(self, containers: Any, labels: dict):
+        self._containers = containers
+        self.labels = labels
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._containers, name)
+
+    def _label(self, kwargs: dict) -> dict:
+        return {
+            **kwargs,
+            "labels": {**(kwargs.get("labels") or {}), **self.labels},
+        }
+
+    def run(self, *args, **kwargs) -> Any:
+        return self._containers.run(*args, **self._label(kwargs))
+
+    def create(self, *args, **kwargs) -> Any:
+        return self._containers.create(*args, **self._label(kwargs))
+
+
+class LabelledDockerClient:
+    """Docker client that labels every container it creates
+
+    datakitpy creates the containers, so this is how dk watch finds the
+    containers it started, without touching those of other dk processes.
+    """
+
+    def __init__(self, client: Any, labels: dict):
+        self._client = client
+        self.labels = labels
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+    @property
+    def containers(self) -> LabelledContainers:
+        return LabelledContainers(self._client.containers, self.labels)
+
+
+class RunWatcher(FileSystemEventHandler):
+    """Re-execute a run and re-render its views when its inputs change
+
+    Execution happens on a worker thread, so a newer change can cancel a run
+    that is still in progress. Datakit errors raised during execution are
+    passed to on_error.
+    """
+
+    # Paths written by the run itself, Python or dk, which never affect
+    # outputs. Directories are matched against path components relative to
+    # the watched run or algorithm directory.
+    ignored_run_dirs = {"views"}
+    ignored_dirs = {"__pycache__"}
+    ignored_suffixes = (".lock", ".tmp")
+
+    def __init__(
+        self,
+        run: Run,
+        view_names: List[str],
+        debounce: float,
+        on_error: Callable[[DatakitError], None],
+    ):
+        self.run = run
+        self.view_names = view_names
+        self.debounce = debounce
+        self.on_error = on_error
+        self.worker = None
+        self.snapshot = self.take_snapshot()
+        self.changed = threading.Event()
+        self.cancelled = threading.Event()
+        self.last_change = 0.0
+        self.label = uuid.uuid4().hex  # Identifies our containers
+        self.run_path = os.path.abspath(run.path)
+        self.algorithm_path = os.path.abspath(
+            f"{run.datakit.path}/{run.algorithm}"
+        )
+
+    def take_snapshot(self) -> dict:
+        """Return a snapshot of the run inputs and algorithm"""
+        if self.worker is not None and self.worker.is_alive():
+            # Our own execution holds the run lock until it finishes, so read
+            # without it. Partially written files fail to parse, and trigger
+            # another change once written.
+            return get_watch_snapshot(self.run)
+
+        with self.run.lock(shared=True):
+            return get_watch_snapshot(self.run)
+
+    def is_ignored(self, path: str) -> bool:
+        """Return whether changes to a path never affect the run outputs"""
+        path = os.path.abspath(path)
+
+        if path.endswith(self.ignored_suffixes):
+            return True
+
+        for root in [self.run_path, self.algorithm_path]:
+            if os.path.commonpath([root, path]) != root:
+                continue
+
+            parts = os.path.relpath(path, root).split(os.sep)
+            if self.ignored_dirs.intersection(parts) or (
+                root == self.run_path and parts[0] in self.ignored_run_dirs
+            ):
+                return True
+
+        return False
+
+    def on_any_event(self, event) -> None:
+        """Record a change to a watched file"""
+        # Atomic writes are renames, so check the destination where present
+        path = getattr(event, "dest_path", "") or event.src_path
+
+        if event.is_directory or self.is_ignored(path):
+            return
+
+        self.last_change = time.monotonic()
+        self.changed.set()
+
+    def wait_for_changes(self) -> None:
+        """Block until changes have stopped arriving for the debounce period"""
+        self.changed.wait()
+
+        while (
+            remaining := self.last_change + self.debounce - time.monotonic()
+        ) > 0:
+            time.sleep(remaining)
+
+        self.changed.clear()
+
+    def handle_changes(self) -> None:
+        """Apply relationships for changed inputs and re-execute the run"""
+        try:
+            snapshot = self.take_snapshot()
+        except (FileNotFoundError, json.JSONDecodeError):
+            # A file is mid-write, it will trigger another change when done
+            return
+
+        if snapshot == self.snapshot:
+            # Only outputs changed
+            return
+
+        self.cancel()
+
+        changed_inputs = [
+            variable_name
+            for variable_name, digest in snapshot["inputs"].items()
+            if self.snapshot["inputs"].get(variable_name) != digest
+        ]
+
+        with self.run.lock():
+            # Relationships write input files in place, so unshare any
+            # legacy shared inputs first
+            self.run.detach_inputs()
+
+            for variable_name in changed_inputs:
+                print(f"[bold]=>[/bold] Detected change to {variable_name}")
+                self.run.execute_relationship(variable_name)
+
+            # Relationships may have changed other inputs
+            algorithm_changed = (
+                snapshot["algorithm"] != self.snapshot["algorithm"]
+            )
+            self.snapshot = get_watch_snapshot(self.run)
+
+        if algorithm_changed:
+            print(f"[bold]=>[/bold] Detected change to {self.run.algorithm}")
+
+        self.start()
+
+    def start(self) -> None:
+        """Execute the run on a worker thread"""
+        self.cancelled.clear()
+        self.worker = threading.Thread(target=self.execute, daemon=True)
+        self.worker.start()
+
+    def cancel(self) -> None:
+        """Cancel any execution in progress and wait for it to stop"""
+        if self.worker is None or not self.worker.is_alive():
+            return
+
+        print(f"[yellow]Cancelling execution of {self.run.name}[/yellow]")
+
+        self.cancelled.set()
+        kill_containers(self.label)
+        self.worker.join()
+
+    def execute(self) -> None:
+        """Execute the run and re-render views, unless cancelled"""
+        # Docker clients aren't safe to share between threads
+        docker_client = LabelledDockerClient(
+            docker.from_env(), {WATCH_LABEL: self.label}
+        )
+
+        print(f"[bold]=>[/bold] Executing [bold]{self.run.name}[/bold]")
+
+        try:
+            logs = self.run.execute(docker_client)
+
+            if self.cancelled.is_set():
+                return
+
+            if logs:
+                print(
+                    Panel(
+                        logs,
+                        title="[bold]Execution container output[/bold]",
+                    )
+                )
+
+            print(
+                f"[bold]=>[/bold] Executed [bold]{self.run.name}[/bold] "
+                "successfully"
+            )
+
+            for view_name in self.view_names:
+                if self.cancelled.is_set():
+                    return
+
+                self.run.view(view_name, docker_client)
+
+                print(
+                    "[bold]=>[/bold] Successfully generated "
+                    f"[bold]{view_name}[/bold] view"
+                )
+        except Exception as e:
+            # Killed containers fail in unpredictable ways
+            if self.cancelled.is_set():
+                return
+            if not isinstance(e, DatakitError):
+                raise
+            self.on_error(e)